@@ -0,0 +1,170 @@
+
+import os
+import re
+import fnmatch
+
+
+# access of a section (or path) depending on its authorization directives
+GRANTED = "granted"
+DENIED = "denied"
+RESTRICTED = "restricted"
+
+# section types applied to a directory and to the files within
+DIRECTORY_SECTIONS = ("Directory", "DirectoryMatch")
+FILES_SECTIONS = ("Files", "FilesMatch")
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return value if type(value) == list else [value]
+
+
+def _iter_sections(config, section_type):
+    # yields (argument, directives) of the sections of the given type
+    for sections in _as_list(config.get(section_type)):
+        for argument, directives in sections.items():
+            yield argument.strip('"'), directives if type(directives) == dict else {}
+
+
+def _wildcard_regex(pattern):
+    # apache wildcards don't match the path separator, the section also
+    # applies to every subdirectory of a matching directory
+    pattern = pattern.rstrip("/") or "/"
+    return re.compile(
+        "^" + re.escape(pattern).replace(r"\*", "[^/]*").replace(r"\?", "[^/]") + "(/|$)")
+
+
+def get_section_access(directives):
+    # returns the access granted by the authorization directives of a
+    # section (None if the section contains none)
+    requires = [value.lower().split() for value in _as_list(directives.get("Require"))]
+
+    if requires:
+        # multiple Require directives are combined like <RequireAny>
+        if ["all", "granted"] in requires:
+            return GRANTED
+        if all(require == ["all", "denied"] for require in requires):
+            return DENIED
+        return RESTRICTED
+
+    # access control of apache 2.2 (mod_access_compat)
+    allow_all = "from all" in [value.lower() for value in _as_list(directives.get("Allow"))]
+    deny_all = "from all" in [value.lower() for value in _as_list(directives.get("Deny"))]
+    order = str(directives.get("Order", "deny,allow")).lower().replace(" ", "")
+
+    if allow_all and deny_all:
+        # the directive evaluated last wins
+        return DENIED if order == "allow,deny" else GRANTED
+    if deny_all:
+        return DENIED
+    if allow_all:
+        return GRANTED
+    if directives.get("Allow") or directives.get("Deny"):
+        return RESTRICTED
+
+    return None
+
+
+class PathTrie:
+    # maps directory paths onto the sections configured for them, a lookup
+    # returns the sections of all parent directories in one pass
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, path, item):
+        node = self.root
+        for part in self._split(path):
+            node = node.setdefault(part, {})
+        node.setdefault(None, []).append(item)
+
+    def lookup(self, path):
+        # returns (depth, item) of the path and its parents (shortest first)
+        node = self.root
+        items = [(0, item) for item in node.get(None, [])]
+
+        for depth, part in enumerate(self._split(path), 1):
+            node = node.get(part)
+            if node is None:
+                break
+            items += [(depth, item) for item in node.get(None, [])]
+
+        return items
+
+    def _split(self, path):
+        return [part for part in os.path.normpath(path).split("/") if part]
+
+
+class AccessRules:
+    # compiled <Directory>, <DirectoryMatch>, <Files> and <FilesMatch>
+    # sections of one config layer (main config or virtual host)
+
+    def __init__(self, config, parent=None):
+        self.parent = parent
+        # layer index, later layers are merged after the parent's sections
+        self.layer = parent.layer + 1 if parent else 0
+
+        self.directories = PathTrie()
+        self.directory_regexes = []
+        self.files = []
+
+        for order, (argument, directives) in enumerate(_iter_sections(config, "Directory")):
+            access = get_section_access(directives)
+
+            if argument.startswith("~"):
+                self.directory_regexes.append(
+                    (re.compile(argument[1:].strip().strip('"')), order, access))
+            elif "*" in argument or "?" in argument:
+                self.directory_regexes.append((_wildcard_regex(argument), order, access))
+            else:
+                self.directories.add(argument, (order, access))
+
+        for order, (argument, directives) in enumerate(_iter_sections(config, "DirectoryMatch")):
+            self.directory_regexes.append(
+                (re.compile(argument), order, get_section_access(directives)))
+
+        for section_type in FILES_SECTIONS:
+            for argument, directives in _iter_sections(config, section_type):
+                if section_type == "FilesMatch":
+                    regex = re.compile(argument)
+                elif argument.startswith("~"):
+                    regex = re.compile(argument[1:].strip().strip('"'))
+                else:
+                    regex = re.compile(fnmatch.translate(argument))
+
+                self.files.append((regex, get_section_access(directives)))
+
+    def get_access(self, path, is_dir=False):
+        # returns the access apache grants to the path (merging the sections
+        # like apache: directories from short to long, regular expressions,
+        # files sections)
+        directory = path if is_dir else os.path.dirname(path)
+        layers = self._get_layers()
+
+        # sections of the parent directories (shortest path first)
+        accesses = sorted(
+            (depth, layer.layer, order, access)
+            for layer in layers for depth, (order, access) in layer.directories.lookup(directory))
+        accesses = [access for *_, access in accesses]
+
+        for layer in layers:
+            accesses += [access for regex, _, access in layer.directory_regexes
+                         if regex.search(directory)]
+
+        if not is_dir:
+            name = os.path.basename(path)
+            for layer in layers:
+                accesses += [access for regex, access in layer.files if regex.search(name)]
+
+        # the last section with authorization directives wins (apache 2.4
+        # grants access if none is configured)
+        return next((access for access in reversed(accesses) if access), GRANTED)
+
+    def _get_layers(self):
+        layers = []
+        layer = self
+        while layer:
+            layers.insert(0, layer)
+            layer = layer.parent
+        return layers
@@ -1,23 +1,165 @@
 
 import os
 import re
+import json
+import hashlib
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
 
 from pprint import pformat
 
 # https://pypi.org/project/apacheconfig/
 import apacheconfig
+from apacheconfig.reader import LocalHostReader
+
+from StateFiles import load_state_file, write_state_file
 
 
 class ApacheConfigException(Exception):
     pass
 
 
+# matches an env var placeholder (e.g. ${APACHE_LOG_DIR})
+VAR_REGEX = re.compile(r"\$\{(\w+)\}")
+
+# min number of unparsed files in an include directory before they are
+# parsed in worker processes (starting the pool costs more than parsing a
+# few small files)
+PARALLEL_PARSE_MIN_FILES = 16
+
+# parser of the worker processes (created in each worker after forking)
+_worker_parser = None
+
+
+def _init_worker(options):
+    global _worker_parser
+    _worker_parser = apacheconfig.make_parser(**options)(apacheconfig.make_lexer(**options)())
+
+
+def _parse_worker(text):
+    return _worker_parser.parse(text)
+
+
+def _get_digest(text):
+    return hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def _get_mtime(path):
+    # modification time (ns) of the path or None if it doesn't exist
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class TrackingReader(LocalHostReader):
+    # reader for the apacheconfig loader that records the modification time
+    # of every path it accesses (included files and directories as well as
+    # paths that were checked but don't exist)
+
+    def __init__(self):
+        super().__init__()
+        self.mtimes = {}
+        # called with the paths of a directory before its files get loaded
+        self.on_listdir = None
+
+    def exists(self, filepath):
+        self._track(filepath)
+        return super().exists(filepath)
+
+    def isdir(self, filepath):
+        self._track(filepath)
+        return super().isdir(filepath)
+
+    def listdir(self, filepath):
+        self._track(filepath)
+        names = super().listdir(filepath)
+
+        if self.on_listdir:
+            self.on_listdir([os.path.join(filepath, name) for name in names])
+
+        return names
+
+    def open(self, filename, mode='r', encoding='utf-8', bufsize=-1):
+        self._track(filename)
+        # files included using a glob are not listed by the reader -> a new
+        # file changes the mtime of its directory
+        self._track(os.path.dirname(os.path.abspath(filename)))
+        return super().open(filename, mode, encoding, bufsize)
+
+    def _track(self, filepath):
+        # the mtime is recorded before the file is read, a change while
+        # loading invalidates the cache on the next run
+        if filepath not in self.mtimes:
+            self.mtimes[filepath] = _get_mtime(filepath)
+
+
+class ParseCache:
+    # wraps the apacheconfig parser and caches the AST of every parsed text
+    # by its digest -> only new or changed include files get parsed again
+
+    def __init__(self, parser, options, asts=None, workers=None):
+        self.parser = parser
+        self.options = options
+        self.asts = asts if asts is not None else {}
+        self.workers = workers
+        # digests of the texts parsed (or taken from the cache) by this load
+        self.used = set()
+
+    def parse(self, text):
+        digest = _get_digest(text)
+
+        ast = self.asts.get(digest)
+        if ast is None:
+            ast = self.asts[digest] = self.parser.parse(text)
+
+        self.used.add(digest)
+        return ast
+
+    def prefetch(self, paths):
+        # parses the uncached files among the given paths in a pool of worker
+        # processes (the loader then finds their ASTs in the cache)
+        texts = {}
+
+        for path in paths:
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    text = file.read()
+            except (OSError, ValueError):
+                # directories and unreadable files are handled by the loader
+                continue
+
+            digest = _get_digest(text)
+            if text and digest not in self.asts:
+                texts[digest] = text
+
+        workers = min(len(texts) // PARALLEL_PARSE_MIN_FILES,
+                      self.workers or os.cpu_count() or 1)
+
+        if workers <= 1:
+            return
+
+        # forked workers inherit the options (the reader is not picklable)
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"),
+                                 initializer=_init_worker, initargs=(self.options,)) as executor:
+            asts = executor.map(_parse_worker, texts.values(), chunksize=PARALLEL_PARSE_MIN_FILES)
+            self.asts.update(zip(texts, asts))
+
+    def get_used_asts(self):
+        # ASTs of the current files only (drops the ones of old file versions)
+        return {digest: self.asts[digest] for digest in self.used}
+
+
 class ApacheConfig:
 
-    def __init__(self, path, options=None, env_var_file=None):
+    def __init__(self, path, options=None, env_var_file=None, cache_dir=None, workers=None):
         self.path = path
         self.env_var_file = env_var_file
         self.env_vars = None
+        # strings with placeholders -> strings with the env vars substituted
+        # (values are only substituted when they are read)
+        self.substituted = {}
         self.options = options if options != None else {
             "useapacheinclude": True,
             "includerelative": True,
@@ -25,7 +167,20 @@ class ApacheConfig:
             "configpath": [os.path.split(path)[0]]
         }
 
+        # max number of processes parsing include files (default: cpu count)
+        self.workers = workers
+        # AST of each loaded file by digest, reused by reload()
+        self.asts = {}
+
+        # the processed config is cached until one of the loaded files changes
+        self.cache_file = None
+        if cache_dir:
+            digest = hashlib.sha1(self._get_cache_key().encode()).hexdigest()[:16]
+            self.cache_file = os.path.join(
+                cache_dir, f"apache_config_{digest}.json")
+
         self.config = self._load_cfg()
+        self.vhosts = self._index_vhosts()
 
     def get(self, key, vhost=None, default=None):
         value = self.config.get(key, default)
@@ -40,56 +195,177 @@ class ApacheConfig:
                 # override value with vhost val if present
                 value = vhost_cfg.get(key, value)
 
-        return value
+        return self._process_vars(value)
 
     def get_vhost_config(self, vhost_name):
-        vhosts = self.config.get("VirtualHost")
+        # lookup by section name (e.g. *:443), ServerName or ServerAlias
+        return self._process_vars(self.vhosts.get(vhost_name))
 
-        if not vhosts:
-            return None
-        elif type(vhosts) == list:
-            return next((vh[vhost_name] for vh in vhosts if vhost_name in vh), None)
-        else:
-            return vhosts.get(vhost_name)
+    def iter_vhost_configs(self):
+        # yields (name, config) of every VirtualHost section
+        for vhost_name, vhost_cfg in self._iter_raw_vhost_configs():
+            yield vhost_name, self._process_vars(vhost_cfg)
+
+    def iter_effective_vhost_configs(self):
+        # yields (label, config) of every VirtualHost section, the config
+        # contains the directives of the main config overridden by the ones
+        # of the section (like get() with a vhost)
+        main_cfg = {key: self._process_vars(value) for key, value in self.config.items()
+                    if key != "VirtualHost"}
+
+        for vhost_name, vhost_cfg in self.iter_vhost_configs():
+            yield vhost_cfg.get("ServerName", vhost_name), {**main_cfg, **vhost_cfg}
 
     def reload(self):
+        self.substituted = {}
         self.config = self._load_cfg()
+        self.vhosts = self._index_vhosts()
+
+    def _iter_raw_vhost_configs(self):
+        # same as iter_vhost_configs but without substituting env vars
+        vhosts = self.config.get("VirtualHost")
+
+        if not vhosts:
+            return
+        elif type(vhosts) != list:
+            vhosts = [vhosts]
+
+        for vhost in vhosts:
+            for vhost_name, vhost_cfg in vhost.items():
+                yield vhost_name, vhost_cfg
+
+    def _index_vhosts(self):
+        # maps the names of each VirtualHost onto its config (the first
+        # section wins if several share a name, e.g. *:80)
+        index = {}
+
+        for vhost_name, vhost_cfg in self._iter_raw_vhost_configs():
+            names = [vhost_name]
+
+            server_name = self._process_vars(vhost_cfg.get("ServerName"))
+            if type(server_name) == str:
+                # also index the name without port (ServerName host:port)
+                names += [server_name, server_name.split(":")[0]]
+
+            aliases = self._process_vars(vhost_cfg.get("ServerAlias", []))
+            if type(aliases) == str:
+                aliases = [aliases]
+
+            for alias in aliases:
+                names += alias.split()
+
+            for name in names:
+                index.setdefault(name, vhost_cfg)
+
+        return index
 
     def _process_vars(self, value):
+        # returns the value with the env vars substituted (dicts and lists
+        # are copied, the loaded config stays unchanged)
+        if not self.env_vars:
+            return value
+
         if type(value) == str:
             # check if the string contains a placeholder
-            match = re.match("\${(\w+?)}", value)
-            if match:
-                try:
-                    var = match.group(1)
-                    value = value.replace(f"${{{var}}}", self.env_vars[var])
-                except KeyError:
-                    raise ApacheConfigException(
-                        f"Undefined variable ${{{var}}}")
+            return self._substitute(value) if "$" in value else value
 
         elif type(value) == dict:
-            # iterate dict
-            for key, val in value.items():
-                # process each value separately and update dict
-                value[key] = self._process_vars(val)
+            return {key: self._process_vars(val) for key, val in value.items()}
 
-        else:
-            # assume generic iterable (list)
-            value = [self._process_vars(val) for val in value]
+        elif type(value) == list:
+            return [self._process_vars(val) for val in value]
 
         return value
 
+    def _substitute(self, value):
+        result = self.substituted.get(value)
+
+        if result is None:
+            result = self.substituted[value] = VAR_REGEX.sub(self._get_env_var, value)
+
+        return result
+
+    def _get_env_var(self, match):
+        try:
+            return self.env_vars[match.group(1)]
+        except KeyError:
+            raise ApacheConfigException(
+                f"Undefined variable ${{{match.group(1)}}}")
+
     def _load_cfg(self):
-        with apacheconfig.make_loader(**self.options) as loader:
-            config = loader.load(self.path)
+        cached = self._read_cache() if self.cache_file else None
+
+        if cached and self._is_fresh(cached):
+            self.env_vars = cached["env_vars"]
+            self.asts = cached["asts"]
+            return cached["config"]
+
+        # files that didn't change since the last load (or the stale cache)
+        # are not parsed again
+        if cached and not self.asts:
+            self.asts = cached["asts"]
+
+        reader = TrackingReader()
+
+        # the loader modifies the configpath list of the options
+        options = dict(self.options, reader=reader,
+                       configpath=list(self.options.get("configpath", [])))
+
+        parse_cache = ParseCache(
+            apacheconfig.make_parser(**options)(apacheconfig.make_lexer(**options)()),
+            options, self.asts, self.workers)
+
+        # files of include directories are parsed in parallel
+        reader.on_listdir = parse_cache.prefetch
+
+        loader = apacheconfig.ApacheConfigLoader(parse_cache, **options)
+        config = loader.load(self.path)
+
+        self.asts = parse_cache.get_used_asts()
 
         if self.env_var_file:
+            reader._track(self.env_var_file)
             self.env_vars = self._parse_env_vars()
-            for key, value in config.items():
-                config[key] = self._process_vars(value)
+
+        if self.cache_file:
+            self._write_cache(config, reader.mtimes)
 
         return config
 
+    def _get_cache_key(self):
+        # identifies the config file, env var file and loader options
+        options = {key: value for key, value in self.options.items()
+                   if key != "reader"}
+        return json.dumps([os.path.abspath(self.path), self.env_var_file, options],
+                          sort_keys=True, default=str)
+
+    def _read_cache(self):
+        # returns the cached entry if it was created with the same options
+        # (and by the current user)
+        cached = load_state_file(self.cache_file)
+
+        if not isinstance(cached, dict) or cached.get("key") != self._get_cache_key():
+            return None
+
+        return cached
+
+    def _is_fresh(self, cached):
+        # checks if no loaded file has changed since the entry was cached
+        return all(_get_mtime(path) == mtime for path, mtime in cached["mtimes"].items())
+
+    def _write_cache(self, config, mtimes):
+        cached = {
+            "key": self._get_cache_key(),
+            "mtimes": mtimes,
+            "env_vars": self.env_vars,
+            "config": config,
+            "asts": self.asts
+        }
+
+        # the cache is optional, the config is simply loaded next time if
+        # writing fails
+        write_state_file(self.cache_file, json.dumps(cached).encode())
+
     def _parse_env_vars(self):
         env_vars = {}
         regex = re.compile("^export (.*)=(.*)$")
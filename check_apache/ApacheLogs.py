@@ -1,23 +1,100 @@
 
 import re
 import os
+import io
+import gzip
+import mmap
+import stat
+import multiprocessing
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 #https://pypi.org/project/apache-log-parser/1.7.0/
 import apache_log_parser
 
+try:
+    # https://pypi.org/project/zstandard/ (only needed for .zst compressed logs)
+    import zstandard
+except ImportError:
+    zstandard = None
+
 from ApacheConfig import ApacheConfig
+from LogFormat import LogFormatParser, LogFormatException, LineMismatchException, DIRECTIVE_REGEX, \
+    derive_field, parse_time_received_epoch
 
 
 class ApacheLogParserException(Exception):
     pass
 
 
+# matches the request time as written by the %t directive
+TIME_RECEIVED_REGEX = re.compile(
+    rb"\[\d{2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2} [+-]\d{4}\]")
+
+# apache logs the time a request was received but writes the entry once the
+# response is sent -> entries are only roughly ordered by time (seconds)
+SEEK_TOLERANCE = 300
+
+# max number of lines inspected per probe to find a timestamp
+SEEK_MAX_PROBE_LINES = 16
+
+# matches the suffix logrotate appends to rotated logs (e.g. .1, .2.gz or
+# -20191201.zst with dateext)
+ROTATED_SUFFIX_REGEX = re.compile(r"^(?:\.\d+|-\d{8,10})(?:\.gz|\.zst)?$")
+
+# read size used to decompress rotated logs
+DECOMPRESS_CHUNK_SIZE = 1024 * 1024
+
+# arguments of the worker processes counting rotated logs in parallel (set
+# before the workers are forked, so the filter and key functions are
+# inherited instead of pickled)
+_worker_args = None
+
+
+def _init_worker(*args):
+    global _worker_args
+    _worker_args = args
+
+
+def _count_log_file_worker(log_file):
+    parser, line_parser, filter_func, key, skip_errors, since, prefilter = _worker_args
+    parser.skipped_lines = 0
+    counter = parser._count_log_file(
+        log_file, line_parser, filter_func, key, skip_errors, since, prefilter)
+
+    return counter, parser.skipped_lines
+
+
+def _count_task_worker(index):
+    parser, kwargs = _worker_args[0][index]
+    counter = parser.count_log_data(**kwargs, workers=1)
+
+    return counter, parser.skipped_lines
+
+
+def count_log_data_parallel(tasks, workers=None):
+    # runs count_log_data for each (parser, kwargs) task in a pool of worker
+    # processes and returns a (counter, skipped_lines) tuple per task
+    workers = min(len(tasks), workers or os.cpu_count() or 1)
+
+    if workers <= 1:
+        return [(parser.count_log_data(**kwargs), parser.skipped_lines) for parser, kwargs in tasks]
+
+    # forked workers inherit the tasks (parsers and filter functions are
+    # not picklable), only the task index is sent to the workers
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"),
+                             initializer=_init_worker, initargs=(tasks,)) as executor:
+        return list(executor.map(_count_task_worker, range(len(tasks))))
+
+
 class ApacheLogParser:
 
     def __init__(self, config, vhost=None):
-        log_format_list = config.get("LogFormat", vhost=vhost)
-        custom_log = config.get("CustomLog", vhost=vhost)
+        self._setup(config.get("LogFormat", vhost=vhost),
+                    config.get("CustomLog", vhost=vhost))
 
+    def _setup(self, log_format_list, custom_log):
         if not log_format_list:
             raise ApacheLogParserException("No log format specified")
 
@@ -52,31 +129,405 @@ class ApacheLogParser:
             raise ApacheLogParserException(
                 f"The configured CustomLog path does not denote a file: {self.log_file}")
 
+        self.log_format = log_format
+
         # create logfile parser using the given format
         self.parser = apache_log_parser.make_parser(log_format)
 
+        # the log file can only be searched by time if %t is part of the format
+        self.time_ordered = "%t" in log_format
+
+        # number of lines skipped during the last run (format missmatch)
+        self.skipped_lines = 0
+
     @classmethod
-    def from_cfg_path(cls, path, env=None, vhost=None):
-        config = ApacheConfig(path, env_var_file=env)
+    def from_cfg_path(cls, path, env=None, vhost=None, cache_dir=None):
+        config = ApacheConfig(path, env_var_file=env, cache_dir=cache_dir)
         return cls(config, vhost)
 
-    def get_log_data(self, filter_func=None, skip_errors=True):
-        log_data = []
-        with open(self.log_file, "r") as file:
-            for line in file:
-                try:
-                    log_data += [self.parser(line)]
-                except apache_log_parser.LineDoesntMatchException as ex:
-                    if skip_errors:
-                        print("log entry skipped (format missmatch)")
-                        continue
-                    else:
-                        raise ex
-
-        if not filter_func:
-            return log_data
-        else:
-            return [entry for entry in log_data if filter_func(entry)]
+    @classmethod
+    def from_vhost_config(cls, config, vhost_cfg):
+        # creates a parser for a single VirtualHost section (directives that
+        # are not set in the section are taken from the main config)
+        parser = cls.__new__(cls)
+        parser._setup(vhost_cfg.get("LogFormat", config.get("LogFormat")),
+                      vhost_cfg.get("CustomLog", config.get("CustomLog")))
+        return parser
+
+    def get_log_data(self, filter_func=None, skip_errors=True, since=None, prefilter=None, fields=None):
+        return list(self.iter_log_data(filter_func, skip_errors, since, prefilter, fields))
+
+    def iter_log_data(self, filter_func=None, skip_errors=True, since=None, prefilter=None, fields=None):
+        # yields the entries as dict or, if fields are specified, as tuple
+        # containing only the given fields
+        line_parser = self._make_line_parser(fields)
+
+        # reset counter of lines that could not be parsed
+        self.skipped_lines = 0
+
+        # process rotated logs overlapping the period first (oldest first)
+        for log_file in self.find_log_files(since):
+            yield from self._iter_log_file(log_file, line_parser, filter_func, skip_errors, since,
+                                           prefilter)
+
+    def count_log_data(self, filter_func=None, key=None, skip_errors=True, since=None, prefilter=None,
+                       fields=None, workers=None):
+        # counts the matching entries (grouped by key if specified)
+        # without keeping the entries themselves in memory
+        line_parser = self._make_line_parser(fields)
+        log_files = self.find_log_files(since)
+
+        # one worker process per log file (at most one per cpu)
+        workers = min(len(log_files), workers or os.cpu_count() or 1)
+
+        self.skipped_lines = 0
+
+        if workers <= 1:
+            counter = Counter()
+            for log_file in log_files:
+                counter += self._count_log_file(log_file, line_parser, filter_func, key,
+                                                skip_errors, since, prefilter)
+            return counter
+
+        # count independent log files in parallel (fork -> the filter and
+        # key functions don't need to be picklable)
+        counter = Counter()
+        skipped_lines = 0
+
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"),
+                                 initializer=_init_worker,
+                                 initargs=(self, line_parser, filter_func, key, skip_errors, since,
+                                           prefilter)) as executor:
+            for file_counter, file_skipped_lines in executor.map(_count_log_file_worker, log_files):
+                counter += file_counter
+                skipped_lines += file_skipped_lines
+
+        self.skipped_lines = skipped_lines
+        return counter
+
+    def find_log_files(self, since=None):
+        # returns the log file and all rotated logs that may contain entries
+        # received after since (oldest first)
+        if not since:
+            return [self.log_file]
+
+        since -= SEEK_TOLERANCE
+        directory, name = os.path.split(self.log_file)
+
+        rotated_log_files = []
+        for entry in os.scandir(directory or "."):
+            if entry.name.startswith(name) and entry.is_file() and \
+                    ROTATED_SUFFIX_REGEX.match(entry.name[len(name):]):
+                rotated_log_files.append((entry.stat().st_mtime, entry.path))
+
+        log_files = [self.log_file]
+        first_time_received = self._read_first_time_received(self.log_file)
+
+        # walk back in time until a log file starts before the period or
+        # has not been written to during the period
+        for mtime, path in sorted(rotated_log_files, reverse=True):
+            if mtime < since or (first_time_received is not None and first_time_received <= since):
+                break
+
+            log_files.insert(0, path)
+            first_time_received = self._read_first_time_received(path)
+
+        return log_files
+
+    def _open_log_file(self, path):
+        # opens a (compressed) log file for binary reads, compressed files
+        # are decompressed chunk by chunk while reading
+        if path.endswith(".gz"):
+            return io.BufferedReader(gzip.GzipFile(path, "rb"), DECOMPRESS_CHUNK_SIZE)
+
+        if path.endswith(".zst"):
+            if not zstandard:
+                raise ApacheLogParserException(
+                    f"Python module zstandard is required to read {path}")
+
+            return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(
+                open(path, "rb"), read_size=DECOMPRESS_CHUNK_SIZE, closefd=True), DECOMPRESS_CHUNK_SIZE)
+
+        return open(path, "rb")
+
+    def _is_compressed(self, path):
+        return path.endswith(".gz") or path.endswith(".zst")
+
+    def _iter_log_file(self, log_file, line_parser, filter_func, skip_errors, since, prefilter):
+        with self._open_log_file(log_file) as file:
+            # skip all entries older than since (epoch timestamp, if specified),
+            # compressed logs cannot be searched and are read from the start
+            if since and self.time_ordered and not self._is_compressed(log_file):
+                file.seek(self._find_offset(file, since - SEEK_TOLERANCE))
+
+            if prefilter and self._is_mappable(log_file, file):
+                # search the memory mapped file for candidate lines, lines
+                # that cannot match are never copied or decoded
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    lines = self._iter_candidate_lines(mapped, file.tell(), prefilter)
+                    yield from self._parse_lines(lines, line_parser, filter_func, skip_errors)
+            else:
+                # buffered reads (compressed logs, pipes)
+                lines = (line for line in file
+                         if not prefilter or self._is_candidate(line, prefilter))
+                yield from self._parse_lines(lines, line_parser, filter_func, skip_errors)
+
+    def _parse_lines(self, lines, line_parser, filter_func, skip_errors):
+        for line in lines:
+            entry = self._parse_line(line_parser, line, skip_errors)
+
+            if entry and (not filter_func or filter_func(entry)):
+                yield entry
+
+    def _is_mappable(self, log_file, file):
+        # only non-empty, uncompressed regular files can be memory mapped
+        # (decompressing readers have no file descriptor)
+        if self._is_compressed(log_file):
+            return False
+
+        stats = os.fstat(file.fileno())
+        return stat.S_ISREG(stats.st_mode) and stats.st_size > 0
+
+    def _iter_candidate_lines(self, mapped, offset, prefilter):
+        # yields all lines after offset that contain a token of each prefilter
+        # group: the map is searched for the tokens of the first group and
+        # only the lines containing one of them are checked and copied
+        tokens, groups = prefilter[0], prefilter[1:]
+
+        # position of the next occurrence of each token
+        positions = {token: mapped.find(token, offset) for token in tokens}
+
+        while True:
+            found = [position for position in positions.values() if position != -1]
+
+            if not found:
+                return
+
+            # determine the line containing the next token
+            position = min(found)
+            start = max(mapped.rfind(b"\n", offset, position) + 1, offset)
+            end = mapped.find(b"\n", position)
+            end = len(mapped) if end == -1 else end + 1
+
+            if all(any(mapped.find(token, start, end) != -1 for token in group) for group in groups):
+                yield mapped[start:end]
+
+            # continue after the current line
+            offset = end
+            for token, position in positions.items():
+                if position != -1 and position < end:
+                    positions[token] = mapped.find(token, end)
+
+    def _count_log_file(self, log_file, line_parser, filter_func, key, skip_errors, since, prefilter):
+        counter = Counter()
+
+        for entry in self._iter_log_file(log_file, line_parser, filter_func, skip_errors, since,
+                                         prefilter):
+            counter[key(entry) if key else None] += 1
+
+        return counter
+
+    def count_new_log_data(self, checkpoint, key, filter_func=None, skip_errors=True, since=None,
+                           prefilter=None, fields=None, time_key=None):
+        # counts the matching entries appended since the last run into the
+        # time buckets of the checkpoint and returns the totals (grouped by
+        # key) of all buckets within the period
+        line_parser = self._make_line_parser(fields)
+
+        # time_key has to return the (epoch) timestamp of an entry
+        if not time_key:
+            def time_key(x): return derive_field("time_received_epoch", x)
+
+        self.skipped_lines = 0
+
+        # the period grew since the last run -> count it from scratch
+        if since and not checkpoint.covers(since):
+            checkpoint.reset()
+
+        stats = os.stat(self.log_file)
+        offset = checkpoint.get_position(stats)
+
+        if offset is None and checkpoint.inode is not None:
+            # log has been rotated or truncated -> the new file has to be
+            # read from the start, but the remainder of the old file (if it
+            # still exists) is counted first
+            offset = 0
+            rotated_log_file = self._find_rotated_log_file(checkpoint.inode)
+
+            if rotated_log_file:
+                with open(rotated_log_file, "rb") as file:
+                    file.seek(checkpoint.offset)
+                    self._count_lines(file, checkpoint, line_parser, key, time_key,
+                                      filter_func, skip_errors, prefilter)
+
+        with open(self.log_file, "rb") as file:
+            if offset is not None:
+                # continue where the last run stopped
+                file.seek(offset)
+            elif since and self.time_ordered:
+                # no checkpoint yet -> start at the beginning of the period
+                file.seek(self._find_offset(file, since - SEEK_TOLERANCE))
+
+            offset = self._count_lines(file, checkpoint, line_parser, key, time_key,
+                                       filter_func, skip_errors, prefilter)
+
+        checkpoint.set_position(stats.st_ino, offset)
+
+        if since:
+            checkpoint.expire(since)
+
+        return Counter(checkpoint.totals())
+
+    def _count_lines(self, file, checkpoint, line_parser, key, time_key, filter_func, skip_errors,
+                     prefilter):
+        # adds the matching entries to the checkpoint and returns the offset
+        # after the last complete line
+        offset = file.tell()
+
+        for line in file:
+            # incomplete line (still being written) -> process it next run
+            if not line.endswith(b"\n"):
+                break
+
+            offset += len(line)
+
+            if prefilter and not self._is_candidate(line, prefilter):
+                continue
+
+            entry = self._parse_line(line_parser, line, skip_errors)
+
+            if entry and (not filter_func or filter_func(entry)):
+                checkpoint.add(time_key(entry), key(entry))
+
+        return offset
+
+    def make_prefilter(self, status=None, contains=None):
+        # builds a byte level check that is evaluated before a line gets
+        # parsed: a line is only parsed if it contains at least one token of
+        # each group
+        prefilter = []
+
+        if status:
+            # surround the status codes with the literals that enclose the
+            # status directive in the log format (e.g. '" 404 ')
+            prefix, suffix = self._get_enclosing_literals(("%>s", "%s", "%<s"))
+            prefilter.append(
+                tuple(f"{prefix}{code}{suffix}".encode() for code in status))
+
+        if contains:
+            prefilter.append(tuple(token.encode() for token in contains))
+
+        return prefilter
+
+    def _is_candidate(self, line, prefilter):
+        return all(any(token in line for token in group) for group in prefilter)
+
+    def _get_enclosing_literals(self, directives):
+        # returns the literal text directly before and after the first of
+        # the given directives found in the log format
+        matches = list(DIRECTIVE_REGEX.finditer(self.log_format))
+
+        for i, match in enumerate(matches):
+            if match.group(0) in directives:
+                start = matches[i - 1].end() if i > 0 else 0
+                end = matches[i + 1].start() if i + 1 < len(matches) else match.end()
+                return self.log_format[start:match.start()], self.log_format[match.end():end]
+
+        return "", ""
+
+    def _make_line_parser(self, fields):
+        # returns a function that parses a single line
+        if not fields:
+            return self.parser
+
+        try:
+            # compiled parser that only extracts the requested fields
+            return LogFormatParser(self.log_format, fields)
+        except LogFormatException:
+            # format not supported -> project the entries of the generic
+            # parser onto the requested fields
+            def project(line):
+                entry = self.parser(line)
+                return tuple(entry[field] if field in entry else derive_field(field, entry)
+                             for field in fields)
+
+            return project
+
+    def _parse_line(self, line_parser, line, skip_errors):
+        try:
+            return line_parser(line.decode("utf-8", "replace"))
+        except (apache_log_parser.LineDoesntMatchException, LineMismatchException) as ex:
+            if skip_errors:
+                # format missmatch -> count and skip entry
+                self.skipped_lines += 1
+                return None
+            else:
+                raise ex
+
+    def _find_rotated_log_file(self, inode):
+        # logrotate moves the current log file to <CustomLog>.1
+        path = f"{self.log_file}.1"
+
+        try:
+            if os.stat(path).st_ino == inode:
+                return path
+        except OSError:
+            pass
+
+        return None
+
+    def _find_offset(self, file, since):
+        # binary search for the offset of the first line received at or
+        # after since (the log is appended in chronological order)
+        low, high = 0, os.fstat(file.fileno()).st_size
+
+        while low < high:
+            mid = (low + high) // 2
+            time_received = self._read_time_received(file, mid)
+
+            if time_received is None or time_received >= since:
+                high = mid
+            else:
+                low = mid + 1
+
+        return self._line_start(file, low)
+
+    def _line_start(self, file, offset):
+        # returns the offset of the first line starting at or after offset
+        if offset == 0:
+            return 0
+
+        file.seek(offset - 1)
+        file.readline()
+        return file.tell()
+
+    def _read_first_time_received(self, path):
+        # returns the request time of the first entry of the given log file
+        # (None if unknown)
+        if not self.time_ordered:
+            return None
+
+        with self._open_log_file(path) as file:
+            return self._read_time_received(file)
+
+    def _read_time_received(self, file, offset=None):
+        # returns the request time of the first line starting at or after
+        # offset (None if no timestamp is found before EOF)
+        if offset is not None:
+            file.seek(self._line_start(file, offset))
+
+        for _ in range(SEEK_MAX_PROBE_LINES):
+            line = file.readline()
+
+            if not line:
+                return None
+
+            match = TIME_RECEIVED_REGEX.search(line)
+
+            if match:
+                return parse_time_received_epoch(match.group(0).decode("ascii"))
+
+        return None
 
     def _find_logformat_by_nickname(self, log_format_list, nickname):
         regex = re.compile(f'"(.+)" {nickname}$')
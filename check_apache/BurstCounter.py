@@ -0,0 +1,102 @@
+
+from array import array
+
+
+class BurstWindow:
+    # counts of one key in a ring of time buckets covering the window plus
+    # some slack for entries logged out of order, the peak of the windows
+    # that can't change anymore is kept while the ring moves on
+    __slots__ = ("counts", "head", "final", "current", "peak", "total")
+
+    def __init__(self, size, head, slack):
+        self.counts = array("I", [0]) * size
+        # newest bucket seen
+        self.head = head
+        # last bucket a window ending there was added to the peak for, the
+        # windows ending after it may still receive late entries
+        self.final = head - slack - 1
+        # sum of the window ending at the final bucket
+        self.current = 0
+        self.peak = 0
+        self.total = 0
+
+
+class BurstCounter:
+
+    def __init__(self, since, until, window, bucket_width=10, slack=60):
+        self.since = int(since)
+        self.bucket_width = bucket_width
+        # number of buckets needed to cover the period
+        self.num_buckets = max((int(until) - self.since) // bucket_width + 1, 1)
+        # buckets per window (windows slide by one bucket)
+        self.window = min(max(window // bucket_width, 1), self.num_buckets)
+        # buckets an entry may be older than the newest one of its key, older
+        # entries are counted in the oldest bucket that is still open
+        self.slack = -(-slack // bucket_width)
+        # the ring holds the open buckets and the window before them
+        self.size = self.window + self.slack + 1
+        # key -> BurstWindow
+        self.windows = {}
+
+    def add(self, timestamp, key):
+        index = (int(timestamp) - self.since) // self.bucket_width
+
+        # ignore entries outside of the period
+        if index < 0 or index >= self.num_buckets:
+            return
+
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = BurstWindow(self.size, index, self.slack)
+        elif index > window.head:
+            self._advance(window, index)
+
+        index = max(index, window.final + 1)
+        window.counts[index % self.size] += 1
+        window.total += 1
+
+    def totals(self):
+        # number of entries per key within the whole period
+        return {key: window.total for key, window in self.windows.items()}
+
+    def peaks(self):
+        # highest number of entries per key within any time window
+        peaks = {}
+
+        for key, window in self.windows.items():
+            # no more entries -> all windows are final
+            self._finalize(window, window.head)
+            peaks[key] = window.peak
+
+        return peaks
+
+    def _advance(self, window, head):
+        # moves the newest bucket of the window to head, the windows ending
+        # more than the slack before it become final
+        self._finalize(window, head - self.slack - 1)
+
+        # clear the ring slots of the skipped and the new buckets
+        for index in range(window.head + 1, min(head, window.head + self.size) + 1):
+            window.counts[index % self.size] = 0
+
+        window.head = head
+
+    def _finalize(self, window, end):
+        # adds the windows ending up to end to the peak
+        counts = window.counts
+
+        while window.final < end:
+            window.final += 1
+
+            # the remaining windows only contain empty buckets
+            if window.final - self.window >= window.head:
+                window.final = end
+                window.current = 0
+                break
+
+            if window.final <= window.head:
+                window.current += counts[window.final % self.size]
+            window.current -= counts[(window.final - self.window) % self.size]
+
+            if window.current > window.peak:
+                window.peak = window.current
@@ -0,0 +1,127 @@
+
+import re
+import ssl
+
+from functools import lru_cache
+
+
+class CipherStringException(Exception):
+    pass
+
+
+# cipher levels from weakest to strongest (names like the OpenSSL keywords)
+CIPHER_LEVELS = {
+    "null": 0,
+    "export": 1,
+    "low": 2,
+    "medium": 3,
+    "high": 4
+}
+
+# level of the ciphers enabled by a keyword, used for ciphers the local
+# OpenSSL doesn't provide anymore (e.g. RC4 or 3DES with OpenSSL 3)
+KEYWORD_LEVELS = {
+    "NULL": "null",
+    "eNULL": "null",
+    "aNULL": "null",
+    "ADH": "null",
+    "AECDH": "null",
+    "EXPORT": "export",
+    "EXP": "export",
+    "LOW": "low",
+    "DES": "low",
+    "3DES": "low",
+    "RC4": "low",
+    "RC2": "low",
+    "MD5": "low",
+    "MEDIUM": "medium",
+    "IDEA": "medium",
+    "SEED": "medium"
+}
+
+# separators of the cipher string elements
+SEPARATOR_REGEX = re.compile(r"[:, ]+")
+
+
+def get_cipher_level(cipher):
+    # grades a cipher as returned by SSLContext.get_ciphers()
+    if cipher["strength_bits"] == 0 or cipher["auth"] == "auth-null":
+        # no encryption or no authentication (anonymous)
+        return "null"
+    if cipher["strength_bits"] < 56:
+        return "export"
+    if cipher["strength_bits"] < 128 or (cipher["symmetric"] or "").startswith(("rc4", "des")):
+        return "low"
+    # like OpenSSL: 128 bit AES, CAMELLIA, ARIA and CHACHA20 are high
+    if (cipher["symmetric"] or "").startswith(("seed", "idea")):
+        return "medium"
+    return "high"
+
+
+# vhosts mostly share a few cipher strings -> each one is only expanded once
+@lru_cache(maxsize=None)
+def expand_cipher_string(cipher_string):
+    # returns the (name, level) of the TLS <= 1.2 suites the cipher string
+    # enables (the TLS 1.3 suites are not affected by SSLCipherSuite)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+
+    try:
+        # the security level would hide the weak ciphers apache may enable
+        context.set_ciphers(f"{cipher_string}:@SECLEVEL=0")
+    except ssl.SSLError:
+        # all ciphers of the string may be missing in the local OpenSSL
+        return ()
+
+    return tuple((cipher["name"], get_cipher_level(cipher))
+                 for cipher in context.get_ciphers() if cipher["protocol"] != "TLSv1.3")
+
+
+@lru_cache(maxsize=None)
+def get_enabled_keyword_levels(cipher_string):
+    # returns the (keyword, level) of the weak keywords that are added by the
+    # cipher string and not removed permanently (!keyword)
+    elements = [element for element in SEPARATOR_REGEX.split(cipher_string) if element]
+    removed = {element[1:] for element in elements if element.startswith("!")}
+
+    enabled = []
+    for element in elements:
+        # -, + and ! only remove or reorder ciphers, @ are commands
+        if element[0] in "-+!@":
+            continue
+
+        # combined elements (e.g. ECDHE+RC4) enable ciphers of each keyword
+        for keyword in element.split("+"):
+            if keyword in KEYWORD_LEVELS and keyword not in removed:
+                enabled.append((keyword, KEYWORD_LEVELS[keyword]))
+
+    return tuple(enabled)
+
+
+def grade_cipher_suite(value):
+    # returns the suites (or keywords) of the SSLCipherSuite value by level,
+    # the value may contain a protocol (e.g. "TLSv1.3 TLS_AES_256_GCM_SHA384")
+    parts = value.strip('"').split()
+
+    if not parts:
+        raise CipherStringException("Empty cipher string")
+
+    if len(parts) > 1:
+        protocol, cipher_string = parts[0], parts[1]
+
+        # all TLS 1.3 suites provide at least 128 bit AEAD encryption
+        if protocol == "TLSv1.3":
+            return {}
+    else:
+        cipher_string = parts[0]
+
+    suites = expand_cipher_string(cipher_string)
+    keywords = get_enabled_keyword_levels(cipher_string)
+
+    if not suites and not keywords:
+        raise CipherStringException(f"No cipher can be selected by {cipher_string}")
+
+    levels = {}
+    for name, level in suites + keywords:
+        levels.setdefault(level, []).append(name)
+
+    return levels
@@ -0,0 +1,120 @@
+
+import math
+import heapq
+
+from array import array
+
+
+class CountMinSketch:
+
+    def __init__(self, width, depth):
+        self.width = width
+        self.depth = depth
+        # one row of counters per hash function
+        self.rows = [array("I", [0]) * width for _ in range(depth)]
+
+    @classmethod
+    def from_error(cls, error, delta):
+        # estimates exceed the true count by at most error * total with a
+        # probability of 1 - delta
+        return cls(math.ceil(math.e / error), math.ceil(math.log(1 / delta)))
+
+    @property
+    def error(self):
+        return math.e / self.width
+
+    @property
+    def size(self):
+        # memory used by the counters (bytes)
+        return self.width * self.depth * self.rows[0].itemsize
+
+    def add(self, key, count=1):
+        # adds count to the key and returns its new estimate
+        estimate = None
+
+        for seed, row in enumerate(self.rows):
+            index = hash((seed, key)) % self.width
+            row[index] += count
+
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+
+        return estimate
+
+    def estimate(self, key):
+        return min(row[hash((seed, key)) % self.width] for seed, row in enumerate(self.rows))
+
+
+class SpaceSaving:
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        # monitored key -> estimated count
+        self.counts = {}
+        # min heap of (count, key), may contain outdated entries
+        self._heap = []
+
+    def offer(self, key, estimate):
+        # monitors the key with an externally estimated count, the key with
+        # the lowest count is only replaced if the estimate is higher
+        if key not in self.counts and len(self.counts) >= self.capacity:
+            # outdated heap entries never exceed the actual min
+            if estimate <= self._heap[0][0]:
+                return
+
+            min_count, min_key = self._pop_min()
+            if estimate <= min_count:
+                heapq.heappush(self._heap, (min_count, min_key))
+                return
+
+            del self.counts[min_key]
+
+        self.counts[key] = estimate
+        self._push(key)
+
+    def top(self, n):
+        return heapq.nlargest(n, self.counts.items(), key=lambda x: x[1])
+
+    def _push(self, key):
+        heapq.heappush(self._heap, (self.counts[key], key))
+
+        # drop outdated heap entries once the heap grows too large
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(value, key) for key, value in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        while True:
+            count, key = heapq.heappop(self._heap)
+
+            # skip entries of evicted keys and outdated counts
+            if self.counts.get(key) == count:
+                return count, key
+
+
+class HeavyHitters:
+
+    def __init__(self, memory=1024 * 1024, error=None, delta=0.01, capacity=100):
+        if error:
+            self.sketch = CountMinSketch.from_error(error, delta)
+        else:
+            # use the whole memory budget for the sketch counters
+            depth = math.ceil(math.log(1 / delta))
+            self.sketch = CountMinSketch(max(memory // (4 * depth), 1), depth)
+
+        self.candidates = SpaceSaving(capacity)
+        self.total = 0
+
+    def add(self, key, count=1):
+        self.total += count
+        # the sketch decides which keys are monitored -> background keys
+        # with a low count can't evict the heavy hitters
+        self.candidates.offer(key, self.sketch.add(key, count))
+
+    def top(self, n):
+        return self.candidates.top(n)
+
+    @property
+    def max_error(self):
+        # upper bound of the overestimation (holds with probability 1 - delta)
+        return math.ceil(self.sketch.error * self.total)
@@ -0,0 +1,116 @@
+
+import os
+import time
+import fcntl
+import json
+import hashlib
+
+from LogFormat import parse_url_path
+from StateFiles import DEFAULT_STATE_DIR, StateFileException, open_state_file
+
+
+class LogAnalyzer:
+
+    def __init__(self, parser, snapshot_dir=DEFAULT_STATE_DIR, ttl=60):
+        self.parser = parser
+        self.ttl = ttl
+
+        # one snapshot per log file
+        digest = hashlib.sha1(parser.log_file.encode()).hexdigest()[:16]
+        self.snapshot_file = os.path.join(
+            snapshot_dir, f"apache_logs_{digest}.json")
+
+    def get_results(self, period, since, honeypots=()):
+        # returns the analysis results for the given period, either from a
+        # fresh snapshot or by analyzing the log (and storing a new snapshot)
+        try:
+            fd = open_state_file(self.snapshot_file, os.O_RDWR | os.O_CREAT)
+        except (OSError, StateFileException):
+            # a snapshot planted by another user must not be used, the
+            # results are computed by this plugin alone
+            return self.analyze(since, honeypots)
+
+        with os.fdopen(fd, "r+") as file:
+            # concurrent plugins wait for the running analysis and then use
+            # its results instead of reading the log again
+            fcntl.flock(file, fcntl.LOCK_EX)
+
+            try:
+                snapshot = json.load(file)
+            except ValueError:
+                snapshot = {}
+
+            results = snapshot.get(period)
+
+            if self._is_valid(results, honeypots):
+                return results
+
+            # also keep analyzing honeypots requested by other plugins
+            if results and results["log_file"] == self.parser.log_file:
+                honeypots = set(honeypots) | set(results["honeypots"])
+
+            snapshot[period] = results = self.analyze(since, honeypots)
+
+            # drop results of other periods that have expired
+            snapshot = {key: value for key, value in snapshot.items()
+                        if time.time() - value["created"] <= self.ttl}
+
+            file.seek(0)
+            file.truncate()
+            json.dump(snapshot, file)
+
+        return results
+
+    def analyze(self, since, honeypots=()):
+        # single pass over the log computing everything the plugins need
+        honeypots = sorted(honeypots)
+
+        results = {
+            "log_file": self.parser.log_file,
+            "created": time.time(),
+            "since": since,
+            "honeypots": honeypots,
+            # number of entries per status code
+            "status": {},
+            # number of entries per status code and ip (any code may be
+            # monitored by check_logs -rc)
+            "ips": {},
+            # number of 404 entries per honeypot and ip
+            "honeypot_hits": {honeypot: {} for honeypot in honeypots},
+            "skipped_lines": 0
+        }
+
+        status_counts = results["status"]
+        ip_counts_by_status = results["ips"]
+        honeypot_hits = results["honeypot_hits"]
+
+        for _, status, remote_host, request in self.parser.iter_log_data(
+                lambda x: x[0] >= since, since=since,
+                fields=("time_received_epoch", "status", "remote_host", "request_first_line")):
+
+            status_counts[status] = status_counts.get(status, 0) + 1
+
+            ip_counts = ip_counts_by_status.setdefault(status, {})
+            ip_counts[remote_host] = ip_counts.get(remote_host, 0) + 1
+
+            # the request path is only extracted for 404 entries
+            if status == "404" and honeypots:
+                path = parse_url_path(request)
+
+                if path in honeypot_hits:
+                    hits = honeypot_hits[path]
+                    hits[remote_host] = hits.get(remote_host, 0) + 1
+
+        results["skipped_lines"] = self.parser.skipped_lines
+
+        return results
+
+    def _is_valid(self, results, honeypots):
+        # results can be reused if they are not older than the ttl and cover
+        # all requested honeypots (snapshots without per ip counts of every
+        # status are outdated)
+        return results is not None and \
+            "ips" in results and \
+            results["log_file"] == self.parser.log_file and \
+            time.time() - results["created"] <= self.ttl and \
+            set(honeypots) <= set(results["honeypots"])
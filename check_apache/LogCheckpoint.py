@@ -0,0 +1,152 @@
+
+import os
+import errno
+import fcntl
+import json
+import tempfile
+
+from StateFiles import StateFileException, open_state_file
+
+
+class LogCheckpointException(Exception):
+    pass
+
+
+class LogCheckpoint:
+
+    def __init__(self, path, log_file, signature="", bucket_width=60):
+        self.path = path
+        self.log_file = log_file
+        # identifies the filter the stored counts were created with
+        self.signature = signature
+        self.bucket_width = bucket_width
+        self.file_obj = None
+        self.data = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # only persist the state if the log was processed successfully
+        if not exc_type:
+            self.commit()
+        self.close()
+
+    def open(self):
+        # create the state file if it does not exist yet and acquire an
+        # exclusive lock (serializes concurrent plugin runs)
+        try:
+            fd = open_state_file(self.path, os.O_RDWR | os.O_CREAT)
+            self.file_obj = os.fdopen(fd, "r+")
+        except (OSError, StateFileException) as ex:
+            if isinstance(ex, OSError) and ex.errno != errno.ELOOP:
+                raise
+
+            # a symlink or a file planted by another user must not be used,
+            # start over with an empty state that is not kept
+            self.file_obj = tempfile.TemporaryFile("w+")
+
+        fcntl.flock(self.file_obj, fcntl.LOCK_EX)
+
+        try:
+            self.data = json.load(self.file_obj)
+        except ValueError:
+            # empty or damaged state file -> start over
+            self.data = None
+
+        if not self._is_compatible():
+            self.reset()
+
+        return self
+
+    def reset(self):
+        # drops the stored position and counts (the log is read from the
+        # beginning of the period again)
+        self.data = {
+            "log_file": self.log_file,
+            "signature": self.signature,
+            "bucket_width": self.bucket_width,
+            "inode": None,
+            "offset": 0,
+            # earliest (epoch) timestamp the buckets cover
+            "since": None,
+            "buckets": {}
+        }
+
+    def close(self):
+        if not self.file_obj:
+            return
+
+        self.file_obj.close()
+        self.file_obj = None
+
+    def commit(self):
+        if not self.file_obj:
+            raise LogCheckpointException(
+                f"Cannot commit closed checkpoint {self.path}")
+
+        self.file_obj.seek(0)
+        self.file_obj.truncate()
+        json.dump(self.data, self.file_obj)
+        self.file_obj.flush()
+        os.fsync(self.file_obj.fileno())
+
+    def get_position(self, stats):
+        # returns the offset to continue reading the log file from or None
+        # if the file has been rotated or truncated since the last run
+        if self.data["inode"] != stats.st_ino or stats.st_size < self.data["offset"]:
+            return None
+
+        return self.data["offset"]
+
+    def set_position(self, inode, offset):
+        self.data["inode"] = inode
+        self.data["offset"] = offset
+
+    @property
+    def inode(self):
+        return self.data["inode"]
+
+    @property
+    def offset(self):
+        return self.data["offset"]
+
+    def add(self, timestamp, key, count=1):
+        # add count to the time bucket the given (epoch) timestamp falls into
+        bucket = self.data["buckets"].setdefault(
+            str(int(timestamp) // self.bucket_width * self.bucket_width), {})
+        bucket[key] = bucket.get(key, 0) + count
+
+    def covers(self, since):
+        # checks if the counts include all entries after since (epoch
+        # timestamp), buckets before the period of an earlier run (e.g. with
+        # a shorter --period) are gone
+        if self.data["inode"] is None:
+            return True
+
+        return self.data.get("since") is not None and self.data["since"] <= since
+
+    def expire(self, since):
+        # drop all buckets that ended before since (epoch timestamp)
+        first = int(since) // self.bucket_width * self.bucket_width
+        self.data["buckets"] = {bucket: counts for bucket, counts in self.data["buckets"].items()
+                                if int(bucket) >= first}
+        self.data["since"] = since
+
+    def totals(self):
+        # sum up the counts of all buckets per key
+        totals = {}
+        for counts in self.data["buckets"].values():
+            for key, count in counts.items():
+                totals[key] = totals.get(key, 0) + count
+
+        return totals
+
+    def _is_compatible(self):
+        # stored counts can only be reused if they were created for the same
+        # log file, filter and bucket width
+        return isinstance(self.data, dict) and \
+            self.data.get("log_file") == self.log_file and \
+            self.data.get("signature") == self.signature and \
+            self.data.get("bucket_width") == self.bucket_width
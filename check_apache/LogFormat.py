@@ -0,0 +1,210 @@
+
+import re
+import calendar
+
+from datetime import datetime
+from functools import lru_cache
+from urllib.parse import urlparse
+
+
+class LogFormatException(Exception):
+    pass
+
+
+class LineMismatchException(LogFormatException):
+    pass
+
+
+# matches a single LogFormat directive (e.g. %h, %>s or %{Referer}i)
+DIRECTIVE_REGEX = re.compile(r"%[<>]?(?:\{([^}]*)\})?([a-zA-Z%])")
+
+# field name and regex of the directives without argument
+# (names are compatible with apache_log_parser)
+DIRECTIVES = {
+    "a": ("remote_ip", r"\S+"),
+    "A": ("local_ip", r"\S+"),
+    "b": ("response_bytes_clf", r"\d+|-"),
+    "B": ("response_bytes", r"\d+"),
+    "D": ("time_us", r"-?\d+"),
+    "f": ("filename", r".*?"),
+    "h": ("remote_host", r"\S+"),
+    "H": ("protocol", r"\S+"),
+    "I": ("bytes_rx", r"\d+|-"),
+    "k": ("num_keepalives", r"\d+"),
+    "l": ("remote_logname", r"\S+"),
+    "m": ("method", r"\S+"),
+    "O": ("bytes_tx", r"\d+|-"),
+    "p": ("server_port", r"\d+"),
+    "P": ("pid", r"\d+"),
+    "q": ("query_string", r"\S*"),
+    "r": ("request_first_line", r".*?"),
+    "R": ("handler", r".*?"),
+    "s": ("status", r"\d{3}|-"),
+    "t": ("time_received", r"\[[^\]]*\]"),
+    "T": ("time_s", r"\d+"),
+    "u": ("remote_user", r".*?"),
+    "U": ("url_path", r"\S*"),
+    "v": ("server_name", r"\S*"),
+    "V": ("server_name2", r"\S*"),
+    "X": ("conn_status", r"[X+-]"),
+}
+
+# field name prefix of the directives with argument (e.g. %{Referer}i)
+ARG_DIRECTIVES = {
+    "C": "cookie_",
+    "e": "env_",
+    "i": "request_header_",
+    "n": "note_",
+    "o": "response_header_",
+    "p": "server_port_",
+    "P": "pid_",
+    "t": "time_",
+    "x": "extension_",
+}
+
+MONTHS = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+          "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12}
+
+REQUEST_REGEX = re.compile(
+    r"^(GET|HEAD|POST|OPTIONS|PUT|CONNECT|PATCH|PROPFIND|DELETE)\s?(.{,10000}?)(?:\s+HTTP/(1\.[01]))?$")
+
+
+def parse_time_received(value):
+    # converts "[10/Oct/2000:13:55:36 -0700]" into a naive datetime
+    # (like time_received_datetimeobj of apache_log_parser)
+    return datetime(int(value[8:12]), MONTHS[value[4:7]], int(value[1:3]),
+                    int(value[13:15]), int(value[16:18]), int(value[19:21]))
+
+
+# consecutive log entries mostly share the same second -> caching the last
+# few thousand timestamps avoids converting the same string over and over
+@lru_cache(maxsize=4096)
+def parse_time_received_epoch(value):
+    # converts "[10/Oct/2000:13:55:36 -0700]" into an epoch timestamp
+    # (honours the utc offset written by apache)
+    epoch = calendar.timegm((int(value[8:12]), MONTHS[value[4:7]], int(value[1:3]),
+                             int(value[13:15]), int(value[16:18]), int(value[19:21])))
+    offset = int(value[23:25]) * 3600 + int(value[25:27]) * 60
+
+    return epoch - offset if value[22] == "+" else epoch + offset
+
+
+def _split_request(value):
+    # splits the first line of the request into method, url and http version
+    match = REQUEST_REGEX.match(value)
+    return match.groups() if match else ("", "", "")
+
+
+def parse_url_path(value):
+    match = REQUEST_REGEX.match(value)
+    return urlparse(match.group(2)).path if match else None
+
+
+def _url_query(value):
+    match = REQUEST_REGEX.match(value)
+    return urlparse(match.group(2)).query if match else None
+
+
+# fields computed from a captured field: name -> (source field, function)
+DERIVED_FIELDS = {
+    "time_received_epoch": ("time_received", parse_time_received_epoch),
+    "time_received_datetimeobj": ("time_received", parse_time_received),
+    "time_received_isoformat": ("time_received", lambda x: parse_time_received(x).isoformat()),
+    "request_method": ("request_first_line", lambda x: _split_request(x)[0]),
+    "request_url": ("request_first_line", lambda x: _split_request(x)[1]),
+    "request_http_ver": ("request_first_line", lambda x: _split_request(x)[2]),
+    "request_url_path": ("request_first_line", parse_url_path),
+    "request_url_query": ("request_first_line", _url_query),
+}
+
+
+def derive_field(name, entry):
+    # computes a derived field from an apache_log_parser entry (dict)
+    source, func = DERIVED_FIELDS[name]
+    return func(entry[source])
+
+
+class LogFormatParser:
+
+    def __init__(self, log_format, fields):
+        self.log_format = log_format
+        self.fields = tuple(fields)
+
+        # fields that have to be captured to produce the requested ones
+        captured = []
+        for field in self.fields:
+            source = DERIVED_FIELDS[field][0] if field in DERIVED_FIELDS else field
+            if source not in captured:
+                captured.append(source)
+
+        self.regex, group_index = self._compile(captured)
+
+        # group index and conversion function of each requested field
+        self.converters = []
+        for field in self.fields:
+            if field in DERIVED_FIELDS:
+                source, func = DERIVED_FIELDS[field]
+                self.converters.append((group_index[source], func))
+            else:
+                self.converters.append((group_index[field], None))
+
+    def __call__(self, line):
+        match = self.regex.match(line)
+
+        if not match:
+            raise LineMismatchException(f"Line doesn't match format: {line}")
+
+        groups = match.groups()
+        return tuple(func(groups[i]) if func else groups[i] for i, func in self.converters)
+
+    def _compile(self, captured):
+        # translates the log format into a regex that only contains capture
+        # groups for the given fields
+        pattern = ""
+        position = 0
+        groups = {}
+
+        for match in DIRECTIVE_REGEX.finditer(self.log_format):
+            pattern += re.escape(self.log_format[position:match.start()])
+            position = match.end()
+
+            name, regex = self._resolve_directive(match.group(1), match.group(2))
+
+            if name is None:
+                # %% -> literal percent sign
+                pattern += "%"
+            elif name in captured and name not in groups:
+                groups[name] = f"g{len(groups)}"
+                pattern += f"(?P<{groups[name]}>{regex})"
+            else:
+                pattern += f"(?:{regex})"
+
+        pattern += re.escape(self.log_format[position:]) + r"\r?\n?$"
+
+        missing = [field for field in captured if field not in groups]
+        if missing:
+            raise LogFormatException(
+                f"Fields {missing} are not part of the log format {self.log_format}")
+
+        regex = re.compile(pattern)
+
+        # map each captured field onto its index in match.groups()
+        return regex, {field: regex.groupindex[group] - 1 for field, group in groups.items()}
+
+    def _resolve_directive(self, argument, directive):
+        if directive == "%":
+            return None, None
+
+        if argument is not None:
+            if directive not in ARG_DIRECTIVES:
+                raise LogFormatException(
+                    f"Unsupported directive %{{{argument}}}{directive}")
+
+            name = ARG_DIRECTIVES[directive] + \
+                argument.strip().lower().replace("-", "_")
+            return name, r".*?"
+
+        if directive not in DIRECTIVES:
+            raise LogFormatException(f"Unsupported directive %{directive}")
+
+        return DIRECTIVES[directive]
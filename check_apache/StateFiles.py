@@ -0,0 +1,86 @@
+
+import os
+import stat
+import json
+import tempfile
+
+
+class StateFileException(Exception):
+    pass
+
+
+# per user directory for caches and snapshots, other users can't plant files
+# with the predictable names there (unlike /tmp itself)
+DEFAULT_STATE_DIR = os.path.join(tempfile.gettempdir(), f"check_apache-{os.geteuid()}")
+
+
+def open_state_file(path, flags=os.O_RDONLY):
+    # opens a cache or snapshot file (without following symlinks) and returns
+    # its file descriptor, only files owned by the current user that no other
+    # user can modify are trusted
+    if flags & os.O_CREAT:
+        _make_state_dir(os.path.dirname(path))
+
+    fd = os.open(path, flags | os.O_NOFOLLOW, 0o600)
+
+    try:
+        stats = os.fstat(fd)
+
+        if not stat.S_ISREG(stats.st_mode) or stats.st_uid != os.geteuid() or \
+                stats.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise StateFileException(
+                f"{path} is not a private file of the current user")
+    except BaseException:
+        os.close(fd)
+        raise
+
+    return fd
+
+
+def load_state_file(path):
+    # returns the decoded json content or None if the file is missing,
+    # untrusted or damaged
+    try:
+        with os.fdopen(open_state_file(path), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError, StateFileException):
+        return None
+
+
+def write_state_file(path, content):
+    # writes to a private temporary file first so concurrent plugins never
+    # read a partially written file, returns False if writing failed
+    directory = os.path.dirname(path)
+
+    try:
+        _make_state_dir(directory)
+        fd, tmp_file = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.", dir=directory)
+    except (OSError, StateFileException):
+        return False
+
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(content)
+        os.replace(tmp_file, path)
+    except OSError:
+        # the state is optional, it is simply created again next time
+        os.remove(tmp_file)
+        return False
+
+    return True
+
+
+def _make_state_dir(directory):
+    # only the default directory is created (private), given directories
+    # have to exist
+    if directory != DEFAULT_STATE_DIR:
+        return
+
+    os.makedirs(directory, 0o700, exist_ok=True)
+
+    # the name is predictable -> another user may have created it first
+    stats = os.lstat(directory)
+    if not stat.S_ISDIR(stats.st_mode) or stats.st_uid != os.geteuid() or \
+            stats.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise StateFileException(
+            f"{directory} is not a private directory of the current user")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import argparse
+import random
+import time
+import tracemalloc
+
+from collections import Counter
+
+from HeavyHitters import HeavyHitters
+
+
+def parse_args():
+    # Parses the CLI Arguments and returns a dict containing the
+    # corresponding values
+    argumentParser = argparse.ArgumentParser(
+        description="Compares exact per ip counting with the memory bounded HeavyHitters sketch")
+
+    argumentParser.add_argument(
+        "-n", "--entries", type=int, default=1000000,
+        help="number of generated log entries (default: 1000000)"
+    )
+    argumentParser.add_argument(
+        "-d", "--distinct", type=int, default=500000,
+        help="number of distinct ips of the background traffic (default: 500000)"
+    )
+    argumentParser.add_argument(
+        "-t", "--top", type=int, default=10,
+        help="number of top offenders compared (default: 10)"
+    )
+    argumentParser.add_argument(
+        "-m", "--memory", type=int, nargs="+", default=[64, 256, 1024, 4096],
+        help="sketch memory budgets in KiB (default: 64 256 1024 4096)"
+    )
+
+    return argumentParser.parse_args()
+
+
+def generate_ips(entries, distinct, top):
+    # background traffic spread over many ips plus a few heavy hitters
+    # (roughly 10% of the entries)
+    offenders = [f"192.168.0.{i}" for i in range(top)]
+    ips = []
+
+    for _ in range(entries):
+        if random.random() < 0.1:
+            # offenders with decreasing weights
+            ips.append(offenders[min(int(random.expovariate(0.3)), top - 1)])
+        else:
+            value = random.randrange(distinct)
+            ips.append(f"10.{value >> 16 & 255}.{value >> 8 & 255}.{value & 255}")
+
+    return ips
+
+
+def run(factory, ips):
+    # counts all ips with a new counter (created while memory is traced) and
+    # returns the counter, the elapsed time and the peak memory (bytes)
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    counter = factory()
+    for ip in ips:
+        counter.add(ip)
+
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return counter, elapsed, peak
+
+
+class ExactCounter(Counter):
+
+    def add(self, key):
+        self[key] += 1
+
+
+def main():
+    args = parse_args()
+    ips = generate_ips(args.entries, args.distinct, args.top)
+
+    exact, elapsed, peak = run(ExactCounter, ips)
+    expected = exact.most_common(args.top)
+    print(f"exact:    {elapsed:.2f}s {peak / 1024:.0f} KiB distinct_ips={len(exact)}")
+
+    for memory in args.memory:
+        heavy_hitters, elapsed, peak = run(
+            lambda: HeavyHitters(memory * 1024, capacity=max(args.top, 100)), ips)
+
+        estimates = dict(heavy_hitters.top(args.top))
+
+        # share of the true top offenders found and their mean overestimation
+        recall = sum(ip in estimates for ip, _ in expected) / len(expected)
+        errors = [estimates[ip] - size for ip, size in expected if ip in estimates]
+        mean_error = sum(errors) / len(errors) if errors else 0
+
+        print(f"{memory:>5} KiB: {elapsed:.2f}s {peak / 1024:.0f} KiB recall={recall:.0%} "
+              f"mean_error={mean_error:.1f} max_error={heavy_hitters.max_error}")
+
+
+if __name__ == "__main__":
+    main()
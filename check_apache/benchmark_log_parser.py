@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from datetime import datetime, timedelta
+
+# https://pypi.org/project/apache-log-parser/1.7.0/
+import apache_log_parser
+
+from LogFormat import LogFormatParser
+
+COMBINED = '%h %l %u %t "%r" %>s %O "%{Referer}i" "%{User-Agent}i"'
+
+USER_AGENTS = [
+    "Mozilla/5.0 (X11; Linux x86_64; rv:68.0) Gecko/20100101 Firefox/68.0",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/78.0.3904.108 Safari/537.36",
+    "curl/7.58.0",
+]
+
+
+def parse_args():
+    # Parses the CLI Arguments and returns a dict containing the
+    # corresponding values
+    argumentParser = argparse.ArgumentParser(
+        description="Compares apache_log_parser with the compiled LogFormatParser")
+
+    argumentParser.add_argument(
+        "-n", "--lines", type=int, default=1000000,
+        help="number of log lines in the generated fixture (default: 1000000)"
+    )
+    argumentParser.add_argument(
+        "-f", "--fields", nargs="+", default=["time_received_datetimeobj", "status", "remote_host"],
+        help="fields extracted by the compiled parser"
+    )
+
+    return argumentParser.parse_args()
+
+
+def write_fixture(file, lines):
+    # writes random log lines (combined format) to the given file
+    start = datetime(2019, 12, 1)
+    for i in range(lines):
+        time_received = (start + timedelta(seconds=i // 20)).strftime("%d/%b/%Y:%H:%M:%S +0100")
+        file.write(f'10.0.{random.randint(0, 255)}.{random.randint(0, 255)} - - [{time_received}] '
+                   f'"GET /page/{random.randint(0, 999)}?id={i} HTTP/1.1" '
+                   f'{random.choice(["200", "200", "200", "304", "404"])} {random.randint(200, 90000)} '
+                   f'"-" "{random.choice(USER_AGENTS)}"\n')
+
+
+def run(parser, path):
+    # parses every line of the file and returns the elapsed time
+    start = time.perf_counter()
+    with open(path, "r") as file:
+        for line in file:
+            parser(line)
+
+    return time.perf_counter() - start
+
+
+def main():
+    args = parse_args()
+
+    with tempfile.NamedTemporaryFile("w", suffix=".log", delete=False) as file:
+        write_fixture(file, args.lines)
+
+    try:
+        generic = run(apache_log_parser.make_parser(COMBINED), file.name)
+        print(f"apache_log_parser: {generic:.2f}s ({args.lines / generic:.0f} lines/s)")
+
+        compiled = run(LogFormatParser(COMBINED, args.fields), file.name)
+        print(f"LogFormatParser:   {compiled:.2f}s ({args.lines / compiled:.0f} lines/s)")
+
+        print(f"speedup: {generic / compiled:.1f}x")
+    finally:
+        os.remove(file.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,19 @@
 
 import argparse
 import sys
+import os
+import time
+import json
+import shutil
 import subprocess
+import io
 import re
 import requests
 from xml.etree import ElementTree
 
+from StateFiles import DEFAULT_STATE_DIR, StateFileException, open_state_file, \
+    load_state_file, write_state_file
+
 
 # monitoring plugin return codes
 OK = 0
@@ -14,6 +22,9 @@ WARNING = 1
 CRITICAL = 2
 UNKNOWN = 3
 
+# feed containing the known vulnerabilities of the apache httpd
+FEED_URL = "https://httpd.apache.org/security/vulnerabilities-httpd.xml"
+
 # integers indicating cve severity levels:
 CVE_SEVERITIES = {
     "critical": 4,
@@ -24,6 +35,10 @@ CVE_SEVERITIES = {
 }
 
 
+class FeedException(Exception):
+    pass
+
+
 def parse_args():
     # Parses the CLI Arguments and returns a dict containing the
     # corresponding values
@@ -39,24 +54,82 @@ def parse_args():
         "-c", '--critical', type=int, choices=CVE_SEVERITIES.values(), default=4,
         help='return critical if cve severity is equal or above')
     argumentParser.add_argument(
-        "-e", "--exec", default="httpd", choices=["httpd", "apache2"],
-        help="Specify the executable that should be used to query the server version"
+        "-e", "--exec", nargs="+", default=["httpd"],
+        help="Specify the executable(s) that should be used to query the server version \
+              (e.g. httpd, apache2 or the path of each instance on a multi-instance host)"
+    )
+    argumentParser.add_argument(
+        "-sv", "--server-version", nargs="+", default=None,
+        help="check the given version number(s) (e.g. 2.4.41) instead of querying the executables"
+    )
+    argumentParser.add_argument(
+        "-u", "--url", default=FEED_URL,
+        help=f"url of the vulnerabilities feed (default: {FEED_URL})"
+    )
+    argumentParser.add_argument(
+        "-t", "--timeout", metavar="SECONDS", type=int, default=5,
+        help="timeout of the feed request (default: 5)"
+    )
+    argumentParser.add_argument(
+        "--cache-dir", nargs="?", const=DEFAULT_STATE_DIR, default=None,
+        help="keep a copy of the feed in this directory, it is only revalidated (conditional \
+              request) once it is older than --max-age and used if the request fails, the server \
+              versions are cached there until the executable changes "
+             f"(default if given without value: {DEFAULT_STATE_DIR})"
+    )
+    argumentParser.add_argument(
+        "--max-age", metavar="SECONDS", type=int, default=3600,
+        help="max age of the cached feed before it is revalidated (default: 3600)"
     )
 
     return argumentParser.parse_args()
 
 
-def get_server_version(exec_name, verbose):
-    cmd = exec_name + " -v | grep 'Server version:'"
+def get_server_version(exec_name, verbose, cache_dir=None):
+    # resolve the executable like the shell would
+    path = shutil.which(exec_name)
+
+    if not path:
+        print(f"CRITICAL: Failed to execute command: {exec_name} -v (not found)")
+        sys.exit(CRITICAL)
+
+    # the version only changes if the executable is replaced (upgrade)
+    path = os.path.realpath(path)
+    stats = os.stat(path)
+    signature = [stats.st_ino, stats.st_mtime_ns, stats.st_size]
+
+    cache_file = os.path.join(cache_dir, "apache_versions.json") if cache_dir else None
+    versions = _read_versions(cache_file) if cache_file else {}
+
+    cached = versions.get(path)
+    if cached and cached["signature"] == signature:
+        if verbose:
+            print(f"version_nr: {cached['version']} (cached)")
+
+        return cached["version"]
+
+    version = _query_server_version(path, verbose)
+
+    if cache_file:
+        versions[path] = {"signature": signature, "version": version}
+        write_state_file(cache_file, json.dumps(versions).encode())
+
+    return version
+
+
+def _query_server_version(path, verbose):
+    cmd = [path, "-v"]
 
     try:
-        # execute shell commands to retrieve server version
-        server_version = subprocess.check_output(
-            cmd, shell=True).decode("utf-8")
-    except subprocess.CalledProcessError:
-        print(f"CRITICAL: Failed to execute shell command: {cmd}")
+        # execute the server binary (without shell) to retrieve the version
+        output = subprocess.check_output(cmd, stderr=subprocess.DEVNULL).decode("utf-8")
+    except (OSError, subprocess.CalledProcessError):
+        print(f"CRITICAL: Failed to execute command: {' '.join(cmd)}")
         sys.exit(CRITICAL)
 
+    server_version = next(
+        (line for line in output.splitlines() if line.startswith("Server version:")), "")
+
     if verbose:
         print(server_version)
 
@@ -74,25 +147,148 @@ def get_server_version(exec_name, verbose):
     return match.group(1)
 
 
-def get_cve_list(verbose):
+def _read_versions(cache_file):
+    # executable path -> signature (inode, mtime, size) and version (only
+    # trusted if the cache was written by the current user)
+    versions = load_state_file(cache_file)
+    return versions if isinstance(versions, dict) else {}
+
+
+def get_version_index(args):
+    # returns the index of the feed (version -> max severity and cve ids) and
+    # the age of the cached feed (None if no cache is used)
     try:
-        # retrieve CVE's in xml form
-        response = requests.get(
-            "https://httpd.apache.org/security/vulnerabilities-httpd.xml", timeout=5)
-    except TimeoutError:
-        print("CRITICAL: Could not retrieve CVE's (request timed out)")
+        if args.cache_dir:
+            return get_cached_index(args)
+
+        response = fetch_feed(args.url, args.timeout, {}, args.verbose)
+        return build_version_index(io.BytesIO(response.content)), None
+    except FeedException as ex:
+        print(f"CRITICAL: {ex}")
         sys.exit(CRITICAL)
 
+
+def build_version_index(source):
+    # parses the feed (file or file object) issue by issue and maps each
+    # affected version onto its max severity and cve ids
+    index = {}
+
+    try:
+        for _, element in ElementTree.iterparse(source):
+            if element.tag != "issue":
+                continue
+
+            severity = element.find("severity")
+            severity = CVE_SEVERITIES.get(severity.text if severity is not None else None, 0)
+            cves = [cve.get("name") for cve in element.iter("cve")]
+
+            for affects in element.iter("affects"):
+                entry = index.setdefault(affects.get("version"), [0, []])
+                entry[0] = max(entry[0], severity)
+                entry[1] += [cve for cve in cves if cve not in entry[1]]
+
+            # processed issues are not needed anymore
+            element.clear()
+    except ElementTree.ParseError as ex:
+        raise FeedException(f"Could not parse CVE's ({ex})")
+
+    return index
+
+
+def fetch_feed(url, timeout, headers, verbose):
+    try:
+        response = requests.get(url, headers=headers, timeout=timeout)
+    except requests.Timeout:
+        raise FeedException("Could not retrieve CVE's (request timed out)")
+    except requests.RequestException as ex:
+        raise FeedException(f"Could not retrieve CVE's ({ex})")
+
     if verbose:
         print(f"response_header={response.headers}")
 
-    # check if http response was successful
-    if response.status_code != 200:
-        print("CRITICAL: Could not retrieve CVE's")
-        sys.exit(CRITICAL)
+    # check if http response was successful (304 -> cached feed still valid)
+    if response.status_code not in (200, 304):
+        raise FeedException("Could not retrieve CVE's")
+
+    return response
+
+
+def get_cached_index(args):
+    # returns the index of the cached feed and its age, the feed is
+    # revalidated once it is older than the max age (and served stale if
+    # that fails)
+    feed_file = os.path.join(args.cache_dir, "vulnerabilities-httpd.xml")
+    meta_file = os.path.join(args.cache_dir, "vulnerabilities-httpd.json")
+
+    # a cache planted by another user must not hide vulnerabilities
+    meta = load_state_file(meta_file)
+    if not isinstance(meta, dict):
+        meta = {}
+
+    try:
+        feed = os.fdopen(open_state_file(feed_file), "rb")
+    except (OSError, StateFileException):
+        feed = None
+
+    # the cache only applies to the same feed
+    cached = feed is not None and meta.get("url") == args.url and \
+        isinstance(meta.get("validated"), (int, float))
+
+    if cached and "index" not in meta:
+        # caches created without index
+        meta["index"] = build_version_index(feed)
+
+    if feed:
+        feed.close()
+
+    # a validation time in the future (clock stepped back or tampered cache)
+    # counts as stale
+    age = time.time() - meta["validated"] if cached else None
 
-    # parse response xml and retrieve all cve's (issues)
-    return ElementTree.fromstring(response.text).findall(".//issue")
+    if cached and 0 <= age < args.max_age:
+        return meta["index"], int(age)
+
+    # only download the feed if it changed since it was cached
+    headers = {}
+    if cached and meta.get("etag"):
+        headers["If-None-Match"] = meta["etag"]
+    if cached and meta.get("last_modified"):
+        headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        response = fetch_feed(args.url, args.timeout, headers, args.verbose)
+
+        # a 304 only confirms a cached feed
+        if response.status_code == 304 and not cached:
+            raise FeedException("Could not retrieve CVE's (not modified, but no feed cached)")
+
+        # the index is stored with the feed -> the feed is only parsed once
+        if response.status_code == 200:
+            index = build_version_index(io.BytesIO(response.content))
+    except FeedException as ex:
+        # the age of a cache validated in the future is unknown
+        if not cached or age < 0:
+            raise
+
+        # serve the stale feed (its age is reported as performance data)
+        if args.verbose:
+            print(f"serving stale cached feed: {ex}")
+
+        return meta["index"], int(age)
+
+    if response.status_code == 200:
+        meta = {
+            "url": args.url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "index": index
+        }
+        write_state_file(feed_file, response.content)
+
+    meta["validated"] = time.time()
+    write_state_file(meta_file, json.dumps(meta).encode())
+
+    return meta["index"], 0
 
 
 def main():
@@ -105,36 +301,52 @@ def main():
     if args.verbose:
         print(args)
 
-    # get server version and cve's (in xml format)
-    server_version = get_server_version(args.exec, args.verbose)
-    cve_list = get_cve_list(args.verbose)
+    # get server version(s) and the cve index
+    if args.server_version:
+        server_versions = args.server_version
+    else:
+        server_versions = [get_server_version(exec_name, args.verbose, args.cache_dir)
+                           for exec_name in args.exec]
 
-    # filter cve's by affected server version and map them onto their
-    # severity number as defined in CVE_SEVERITIES
-    severity_list = [CVE_SEVERITIES[cve.find(".//severity").text] for cve in cve_list if
-                     cve.find(f".//affects[@version='{server_version}']") != None]
+    index, cache_age = get_version_index(args)
+
+    # highest severity of the cve's affecting each server version (as
+    # defined in CVE_SEVERITIES) and their ids
+    results = {version: index.get(version, [CVE_SEVERITIES["n/a"], []])
+               for version in server_versions}
 
     if args.verbose:
-        print(f"severity_list={severity_list}")
+        print(f"results={results}")
 
-    # get highest severity cve affecting the given server version
-    max_severity = max(severity_list, default=CVE_SEVERITIES["n/a"])
+    # get highest severity cve affecting the given server versions
+    max_severity = max(severity for severity, _ in results.values())
 
     if args.verbose:
         print(f"max_severity={max_severity}")
 
     # check critical threshold
     if max_severity >= args.critical:
-        print(f"CRITICAL: severity={max_severity}")
-        sys.exit(CRITICAL)
+        returnCode, state = CRITICAL, "CRITICAL"
 
     # check warning threshold
-    if max_severity >= args.warning:
-        print(f"WARNING: severity={max_severity}")
-        sys.exit(WARNING)
+    elif max_severity >= args.warning:
+        returnCode, state = WARNING, "WARNING"
+
+    else:
+        returnCode, state = OK, "OK"
+
+    print(f"{state}: severity={max_severity}")
+
+    # details of each version if several were checked
+    if len(results) > 1:
+        for version, (severity, cves) in results.items():
+            print(f"Apache/{version}: severity={severity} {' '.join(cves)}".rstrip())
+
+    # age of the cached feed (seconds since it was last revalidated)
+    if cache_age is not None:
+        print(f"|cache_age={cache_age}s")
 
-    print(f"OK: severity={max_severity}")
-    sys.exit(OK)
+    sys.exit(returnCode)
 
 
 if __name__ == "__main__":
@@ -6,6 +6,8 @@ import re
 import os
 
 from ApacheConfig import ApacheConfig
+from AccessRules import AccessRules, GRANTED, DIRECTORY_SECTIONS, FILES_SECTIONS
+from StateFiles import DEFAULT_STATE_DIR
 
 # monitoring plugin return codes
 OK = 0
@@ -13,6 +15,9 @@ WARNING = 1
 CRITICAL = 2
 UNKNOWN = 3
 
+# files in the DocumentRoot that must never be served
+PROTECTED_FILES = (".htaccess", ".htpasswd")
+
 
 def parse_args():
     # Parses the CLI Arguments and returns a dict containing the
@@ -31,6 +36,11 @@ def parse_args():
         "-e", "--env", nargs="?", const="/etc/apache2/envvars", default=None,
         help="path to the environment variables file"
     )
+    argumentParser.add_argument(
+        "--config-cache", nargs="?", const=DEFAULT_STATE_DIR, default=None,
+        help="cache the parsed config in this directory until one of its files changes "
+             f"(default if given without value: {DEFAULT_STATE_DIR})"
+    )
 
     return argumentParser.parse_args()
 
@@ -53,10 +63,74 @@ def main():
         print(f"CRITICAL: {args.env} does not denote a file!")
         sys.exit(CRITICAL)
 
-    config = ApacheConfig(args.config, env_var_file=args.env)
+    config = ApacheConfig(args.config, env_var_file=args.env, cache_dir=args.config_cache)
+
+    # ServerRoot defaults to the directory of the main config file
+    server_root = (config.get("ServerRoot") or os.path.dirname(os.path.abspath(args.config))).strip('"')
+
+    returnCode = OK
+    messages = []
+
+    for label, rules, document_root in get_document_roots(config):
+        code, output = check_document_root(rules, document_root, server_root)
+
+        if args.verbose:
+            print(f"{label}: DocumentRoot {document_root} {'OK' if code == OK else 'insecure'}")
+
+        returnCode = max(returnCode, code)
+        messages += [f"{label}: {line}" for line in output]
+
+    if returnCode == OK:
+        print("OK: Access to .ht* files and to server root protected")
+    else:
+        print(f"{'CRITICAL' if returnCode == CRITICAL else 'WARNING'}: "
+              f"Access to .ht* files and/or to server root not protected")
+        for message in messages:
+            print(message)
+
+    sys.exit(returnCode)
+
+
+def get_document_roots(config):
+    # yields (label, access rules, DocumentRoot) of the main config and of
+    # every virtual host, the sections are compiled once per config layer
+    main_rules = AccessRules(
+        {key: config.get(key) for key in DIRECTORY_SECTIONS + FILES_SECTIONS})
+    main_root = config.get("DocumentRoot")
+
+    if main_root:
+        yield "main config", main_rules, main_root.strip('"')
+
+    for vhost_name, vhost_cfg in config.iter_vhost_configs():
+        document_root = vhost_cfg.get("DocumentRoot", main_root)
+
+        if document_root:
+            yield (vhost_cfg.get("ServerName", vhost_name),
+                   AccessRules(vhost_cfg, parent=main_rules), document_root.strip('"'))
+
+
+def check_document_root(rules, document_root, server_root):
+    # returns the return code and the output lines for one DocumentRoot
+    returnCode = OK
+    output = []
+
+    for name in PROTECTED_FILES:
+        path = os.path.join(document_root, name)
+
+        if rules.get_access(path) == GRANTED:
+            returnCode = CRITICAL
+            output.append(f"access to {path} granted")
+
+    if rules.get_access(server_root, is_dir=True) == GRANTED:
+        returnCode = CRITICAL
+        output.append(f"access to ServerRoot {server_root} granted")
+
+    root = os.path.normpath(document_root)
+    if root == os.path.normpath(server_root) or root.startswith(os.path.normpath(server_root) + "/"):
+        returnCode = max(returnCode, WARNING)
+        output.append(f"DocumentRoot {document_root} within ServerRoot {server_root}")
 
-    print("OK: Access to .ht* files and to server root protected")
-    sys.exit(OK)
+    return returnCode, output
 
 
 if __name__ == "__main__":
@@ -4,10 +4,12 @@ import argparse
 import sys
 import os
 import re
+import time
 
 from ApacheLogs import ApacheLogParser
-from datetime import datetime, timedelta
-from itertools import groupby
+from LogAnalyzer import LogAnalyzer
+from StateFiles import DEFAULT_STATE_DIR
+from collections import Counter
 
 
 # monitoring plugin return codes
@@ -46,6 +48,11 @@ def parse_args():
         "-vh", "--vhost", default=None,
         help="specify the virtual host whose config should be loaded (if any)"
     )
+    argumentParser.add_argument(
+        "--config-cache", nargs="?", const=DEFAULT_STATE_DIR, default=None,
+        help="cache the parsed config in this directory until one of its files changes "
+             f"(default if given without value: {DEFAULT_STATE_DIR})"
+    )
     argumentParser.add_argument(
         "-hp", "--honeypot", required=True,
         help="specify the honeypot directory"
@@ -54,6 +61,19 @@ def parse_args():
         '--period', metavar='NUMBER', default='1h', type=period,
         help='check log of last period (default: "1h", format 1-99 m/h/d)'
     )
+    argumentParser.add_argument(
+        "-t", "--top", metavar="NUMBER", type=int, default=10,
+        help="number of ips with the most log entries reported as performance data (default: 10)"
+    )
+    argumentParser.add_argument(
+        "--snapshot-dir", nargs="?", const=DEFAULT_STATE_DIR, default=None,
+        help="share one log analysis between the apache log plugins via a snapshot in this directory "
+             f"(default if given without value: {DEFAULT_STATE_DIR})"
+    )
+    argumentParser.add_argument(
+        "--snapshot-ttl", metavar="SECONDS", type=int, default=60,
+        help="max age of a snapshot before the log is analyzed again (default: 60)"
+    )
 
     return argumentParser.parse_args()
 
@@ -77,44 +97,58 @@ def main():
         print(f"CRITICAL: {args.env} does not denote a file!")
         sys.exit(CRITICAL)
 
-    # get start datetime from configured period
-    start_datetime = _get_start_datetime(args.period)
+    # get start timestamp (epoch) from configured period
+    start_epoch = _get_start_epoch(args.period)
 
     if args.verbose:
-        print(f"start_datetime={start_datetime}")
+        print(f"start_epoch={start_epoch}")
 
     # get log parser from config path
-    parser = ApacheLogParser.from_cfg_path(args.path, args.env, args.vhost)
-
-    log_data = parser.get_log_data(lambda x:
-                                   datetime.fromisoformat(x["time_received_isoformat"]) >= start_datetime and
-                                   x["status"] == "404" and
-                                   x["request_url_path"] == args.honeypot
-                                   )
+    parser = ApacheLogParser.from_cfg_path(args.path, args.env, args.vhost, args.config_cache)
+
+    if args.snapshot_dir:
+        # use the shared analysis (only reads the log if the snapshot expired)
+        results = LogAnalyzer(parser, args.snapshot_dir, args.snapshot_ttl).get_results(
+            args.period, start_epoch, honeypots=[args.honeypot])
+
+        rhost_counts = Counter(results["honeypot_hits"][args.honeypot])
+        parser.skipped_lines = results["skipped_lines"]
+    else:
+        # only lines containing status 404 and the honeypot path get parsed
+        prefilter = parser.make_prefilter(status=["404"], contains=[args.honeypot])
+
+        # count matching entries per ip (streamed, entries are not kept in memory)
+        # fields: time_received_epoch, status, request_url_path, remote_host
+        rhost_counts = parser.count_log_data(lambda x:
+                                             x[0] >= start_epoch and
+                                             x[1] == "404" and
+                                             x[2] == args.honeypot,
+                                             key=lambda x: x[3],
+                                             since=start_epoch,
+                                             prefilter=prefilter,
+                                             fields=("time_received_epoch", "status",
+                                                     "request_url_path", "remote_host")
+                                             )
 
     if args.verbose:
-        print(f"total_count={len(log_data)}")
+        print(f"total_count={sum(rhost_counts.values())}")
 
     returnCode = OK
 
-    def remote_host(x): return x["remote_host"]
+    # any access to the honeypot results in a warning
+    if rhost_counts:
+        returnCode = max(returnCode, WARNING)
 
-    # count entries per ip
-    rhost_list = groupby(sorted(
-        log_data, key=lambda x: x["remote_host"]), key=lambda x: x["remote_host"])
-
-    returnCode = OK
-
-    for rhost in rhost_list:
-        # destructure tuple
-        (ip, entries) = rhost
-        # get iterator length (is there no better way??)
-        size = sum(1 for _ in entries)
-        # TODO return total as performancedata
+    # only report the top offenders (selected using a heap) to keep the
+    # number of performance data series bounded
+    for ip, size in rhost_counts.most_common(args.top):
         print(f"|{ip}={size}")
 
-        if size >= 1:
-            returnCode = max(returnCode, WARNING)
+    print(f"|total={sum(rhost_counts.values())}")
+    print(f"|distinct_ips={len(rhost_counts)}")
+
+    # report lines that did not match the configured LogFormat
+    print(f"|skipped_lines={parser.skipped_lines}")
 
     sys.exit(returnCode)
 
@@ -123,24 +157,18 @@ class InvalidTimeframeException(Exception):
     pass
 
 
-def _get_start_datetime(period):
-    # get current date
-    now = datetime.now()
+def _get_start_epoch(period):
     # match period -> extract quantity and type
-    match = re.match('(\d{1,2})([dhm])', period)
+    match = re.match(r'(\d{1,2})([dhm])', period)
 
     if not match:
         raise InvalidTimeframeException()
 
-    # set quantity for given type and all others to 0
-    quantity = {"d": 0, "h": 0, "m": 0}
-    quantity[match.group(2)] = max(int(match.group(1)), 1)
-
-    # calculate start date
-    now -= timedelta(days=quantity["d"],
-                     hours=quantity["h"], minutes=quantity["m"])
+    # seconds per period type
+    seconds = {"d": 86400, "h": 3600, "m": 60}
 
-    return now
+    # calculate start timestamp
+    return int(time.time()) - max(int(match.group(1)), 1) * seconds[match.group(2)]
 
 
 if __name__ == "__main__":
@@ -4,10 +4,16 @@ import argparse
 import sys
 import os
 import re
+import time
 
-from ApacheLogs import ApacheLogParser
-from datetime import datetime, timedelta
-from itertools import groupby
+from ApacheConfig import ApacheConfig
+from ApacheLogs import ApacheLogParser, ApacheLogParserException, count_log_data_parallel
+from LogAnalyzer import LogAnalyzer
+from StateFiles import DEFAULT_STATE_DIR
+from LogCheckpoint import LogCheckpoint
+from BurstCounter import BurstCounter
+from HeavyHitters import HeavyHitters
+from collections import Counter
 
 
 # monitoring plugin return codes
@@ -47,6 +53,11 @@ def parse_args():
         "-vh", "--vhost", default=None,
         help="specify the virtual host whose config should be loaded (if any)"
     )
+    argumentParser.add_argument(
+        "--config-cache", nargs="?", const=DEFAULT_STATE_DIR, default=None,
+        help="cache the parsed config in this directory until one of its files changes "
+             f"(default if given without value: {DEFAULT_STATE_DIR})"
+    )
     argumentParser.add_argument(
         '--period', metavar='NUMBER', default='1h', type=period,
         help='check log of last period (default: "1h", format 1-99 m/h/d)'
@@ -63,6 +74,55 @@ def parse_args():
         "-rc", "--return-codes", nargs="+", default=["403", "404"],
         help="specify which return codes should be monitored"
     )
+    # the modes of counting the entries can't be combined
+    modes = argumentParser.add_mutually_exclusive_group()
+
+    modes.add_argument(
+        "-s", "--state-file", default=None,
+        help="specify a file to store the log position and counts between runs \
+              (only lines appended since the last run are parsed)"
+    )
+    argumentParser.add_argument(
+        "-t", "--top", metavar="NUMBER", type=int, default=10,
+        help="number of ips with the most log entries reported as performance data (default: 10)"
+    )
+    modes.add_argument(
+        "-r", "--rate-window", metavar="SECONDS", type=int, default=None,
+        help="compare the thresholds with the max number of entries per ip within any window of \
+              this length (e.g. 60 -> per minute) instead of the total of the whole period"
+    )
+    argumentParser.add_argument(
+        "--bucket-width", metavar="SECONDS", type=int, default=10,
+        help="resolution of the time buckets used with --rate-window (default: 10)"
+    )
+    modes.add_argument(
+        "--snapshot-dir", nargs="?", const=DEFAULT_STATE_DIR, default=None,
+        help="share one log analysis between the apache log plugins via a snapshot in this directory "
+             f"(default if given without value: {DEFAULT_STATE_DIR})"
+    )
+    argumentParser.add_argument(
+        "--snapshot-ttl", metavar="SECONDS", type=int, default=60,
+        help="max age of a snapshot before the log is analyzed again (default: 60)"
+    )
+    modes.add_argument(
+        "-a", "--all-vhosts", nargs="?", const=True, default=False,
+        help="check the CustomLog of every virtual host in one run (ignores --vhost, counts the \
+              total of the period per ip)"
+    )
+    modes.add_argument(
+        "--approximate", nargs="?", const=True, default=False,
+        help="count the entries per ip with a fixed size sketch instead of exact counters \
+              (bounded memory with a very large number of distinct ips, counts may be overestimated)"
+    )
+    argumentParser.add_argument(
+        "--sketch-memory", metavar="KIB", type=int, default=1024,
+        help="memory used by the sketch of --approximate (default: 1024)"
+    )
+    argumentParser.add_argument(
+        "--sketch-error", metavar="FRACTION", type=float, default=None,
+        help="max overestimation of --approximate as a fraction of the total count \
+              (e.g. 0.0001, overrides --sketch-memory)"
+    )
 
     return argumentParser.parse_args()
 
@@ -86,45 +146,178 @@ def main():
         print(f"CRITICAL: {args.env} does not denote a file!")
         sys.exit(CRITICAL)
 
-    # get start datetime from configured period
-    start_datetime = _get_start_datetime(args.period)
+    # get start timestamp (epoch) from configured period
+    start_epoch = _get_start_epoch(args.period)
 
     if args.verbose:
-        print(f"start_datetime={start_datetime}")
+        print(f"start_epoch={start_epoch}")
 
-    # get log parser from config path
-    parser = ApacheLogParser.from_cfg_path(args.path, args.env, args.vhost)
+    # only extract the fields needed to filter and count the entries
+    fields = ("time_received_epoch", "status", "remote_host")
+
+    def log_filter(x): return x[0] >= start_epoch and x[1] in args.return_codes
+
+    def remote_host(x): return x[2]
+
+    def time_received(x): return x[0]
+
+    if args.all_vhosts:
+        check_all_vhosts(args, start_epoch, log_filter, remote_host, fields)
 
-    log_data = parser.get_log_data(lambda x: datetime.fromisoformat(
-        x["time_received_isoformat"]) >= start_datetime and x["status"] in args.return_codes)
+    # get log parser from config path
+    parser = ApacheLogParser.from_cfg_path(args.path, args.env, args.vhost, args.config_cache)
+
+    # only lines containing one of the monitored status codes get parsed
+    prefilter = parser.make_prefilter(status=args.return_codes)
+
+    # set by the modes that don't count every ip exactly
+    total_count = None
+    max_error = None
+
+    if args.rate_window:
+        # count entries per ip and time bucket while streaming the log
+        bursts = BurstCounter(start_epoch, time.time(), args.rate_window, args.bucket_width)
+
+        for entry in parser.iter_log_data(log_filter, since=start_epoch, prefilter=prefilter,
+                                          fields=fields):
+            bursts.add(time_received(entry), remote_host(entry))
+
+        # thresholds apply to the busiest window of each ip
+        rhost_counts = Counter(bursts.peaks())
+        total_count = sum(bursts.totals().values())
+    elif args.approximate:
+        # memory stays bounded regardless of the number of distinct ips
+        heavy_hitters = HeavyHitters(args.sketch_memory * 1024, args.sketch_error,
+                                     capacity=max(args.top, 100))
+
+        for entry in parser.iter_log_data(log_filter, since=start_epoch, prefilter=prefilter,
+                                          fields=fields):
+            heavy_hitters.add(remote_host(entry))
+
+        rhost_counts = Counter(dict(heavy_hitters.top(args.top)))
+        total_count = heavy_hitters.total
+        # the sketch does not keep track of all ips, report its error bound instead
+        max_error = heavy_hitters.max_error
+
+        if args.verbose:
+            print(f"sketch_size={heavy_hitters.sketch.size}")
+    elif args.snapshot_dir:
+        # use the shared analysis (only reads the log if the snapshot expired)
+        results = LogAnalyzer(parser, args.snapshot_dir, args.snapshot_ttl).get_results(
+            args.period, start_epoch)
+
+        rhost_counts = Counter()
+        for code in args.return_codes:
+            rhost_counts.update(results["ips"].get(code, {}))
+
+        parser.skipped_lines = results["skipped_lines"]
+    elif args.state_file:
+        # only parse new lines and get the totals from the stored counts
+        signature = ",".join(sorted(args.return_codes))
+
+        with LogCheckpoint(args.state_file, parser.log_file, signature) as checkpoint:
+            rhost_counts = parser.count_new_log_data(
+                checkpoint, remote_host, log_filter, since=start_epoch, prefilter=prefilter,
+                fields=fields, time_key=time_received)
+    else:
+        # count matching entries per ip (streamed, entries are not kept in memory)
+        rhost_counts = parser.count_log_data(
+            log_filter, key=remote_host, since=start_epoch, prefilter=prefilter, fields=fields)
+
+    # with --rate-window rhost_counts contains the peaks instead of the totals
+    # and with --approximate only the top ips
+    if total_count is None:
+        total_count = sum(rhost_counts.values())
 
     if args.verbose:
-        print(f"total_count={len(log_data)}")
+        print(f"total_count={total_count}")
 
     returnCode = OK
 
-    def remote_host(el): return el["remote_host"]
+    # the ip with the most entries determines the result
+    max_count = max(rhost_counts.values(), default=0)
 
-    # count entries per ip
-    rhost_list = groupby(sorted(
-        log_data, key=remote_host), key=remote_host)
+    if max_count >= args.warning:
+        returnCode = max(returnCode, WARNING)
 
-    returnCode = OK
+    if max_count >= args.critical:
+        returnCode = max(returnCode, CRITICAL)
 
-    for rhost in rhost_list:
-        # destructure tuple
-        (ip, entries) = rhost
-        # get iterator length (is there no better way??)
-        size = sum(1 for _ in entries)
-        #TODO return total as performancedata
+    # only report the top offenders (selected using a heap) to keep the
+    # number of performance data series bounded
+    for ip, size in rhost_counts.most_common(args.top):
         print(f"|{ip}={size};{args.warning};{args.critical}")
 
-        if size >= args.warning:
+    print(f"|total={total_count}")
+
+    if max_error is not None:
+        print(f"|max_error={max_error}")
+    else:
+        print(f"|distinct_ips={len(rhost_counts)}")
+
+    # report lines that did not match the configured LogFormat
+    print(f"|skipped_lines={parser.skipped_lines}")
+
+    sys.exit(returnCode)
+
+
+def check_all_vhosts(args, start_epoch, log_filter, remote_host, fields):
+    # counts the entries of all virtual hosts using a single config load
+    config = ApacheConfig(args.path, env_var_file=args.env, cache_dir=args.config_cache)
+
+    # count each log file only once (virtual hosts may share a CustomLog)
+    tasks = {}
+    vhost_log_files = {}
+
+    for vhost_name, vhost_cfg in config.iter_vhost_configs():
+        label = vhost_cfg.get("ServerName", vhost_name)
+
+        try:
+            parser = ApacheLogParser.from_vhost_config(config, vhost_cfg)
+        except ApacheLogParserException as ex:
+            if args.verbose:
+                print(f"{label} skipped: {ex}")
+            continue
+
+        vhost_log_files[label] = parser.log_file
+
+        if parser.log_file not in tasks:
+            tasks[parser.log_file] = (parser, {
+                "filter_func": log_filter,
+                "key": remote_host,
+                "since": start_epoch,
+                "prefilter": parser.make_prefilter(status=args.return_codes),
+                "fields": fields
+            })
+
+    if not tasks:
+        print("UNKNOWN: No virtual host with a CustomLog found")
+        sys.exit(UNKNOWN)
+
+    # process the log files in parallel
+    results = dict(zip(tasks, count_log_data_parallel(list(tasks.values()))))
+
+    returnCode = OK
+
+    for label, log_file in vhost_log_files.items():
+        rhost_counts, _ = results[log_file]
+        max_count = max(rhost_counts.values(), default=0)
+
+        if args.verbose:
+            print(f"{label}: {log_file} total_count={sum(rhost_counts.values())}")
+
+        print(f"|{label}={max_count};{args.warning};{args.critical}")
+
+        if max_count >= args.warning:
             returnCode = max(returnCode, WARNING)
 
-        if size >= args.critical:
+        if max_count >= args.critical:
             returnCode = max(returnCode, CRITICAL)
 
+    # aggregates over all log files
+    print(f"|total={sum(sum(counts.values()) for counts, _ in results.values())}")
+    print(f"|skipped_lines={sum(skipped for _, skipped in results.values())}")
+
     sys.exit(returnCode)
 
 
@@ -132,24 +325,18 @@ class InvalidTimeframeException(Exception):
     pass
 
 
-def _get_start_datetime(period):
-    # get current date
-    now = datetime.now()
+def _get_start_epoch(period):
     # match period -> extract quantity and type
-    match = re.match('(\d{1,2})([dhm])', period)
+    match = re.match(r'(\d{1,2})([dhm])', period)
 
     if not match:
         raise InvalidTimeframeException()
 
-    # set quantity for given type and all others to 0
-    quantity = {"d": 0, "h": 0, "m": 0}
-    quantity[match.group(2)] = max(int(match.group(1)), 1)
-
-    # calculate start date
-    now -= timedelta(days=quantity["d"],
-                     hours=quantity["h"], minutes=quantity["m"])
+    # seconds per period type
+    seconds = {"d": 86400, "h": 3600, "m": 60}
 
-    return now
+    # calculate start timestamp
+    return int(time.time()) - max(int(match.group(1)), 1) * seconds[match.group(2)]
 
 
 if __name__ == "__main__":
@@ -6,6 +6,8 @@ import re
 import os
 
 from ApacheConfig import ApacheConfig
+from CipherString import CIPHER_LEVELS, CipherStringException, grade_cipher_suite
+from StateFiles import DEFAULT_STATE_DIR
 
 # monitoring plugin return codes
 OK = 0
@@ -36,8 +38,17 @@ def parse_args():
         help="virtual host whose config should be loaded (if any)"
     )
     argumentParser.add_argument(
-        "-l", "--level", default="medium",
-        help="no ciphers below this level allowed"
+        "-a", "--all-vhosts", nargs="?", const=True, default=False,
+        help="check every virtual host in one run (ignores --vhost)"
+    )
+    argumentParser.add_argument(
+        "--config-cache", nargs="?", const=DEFAULT_STATE_DIR, default=None,
+        help="cache the parsed config in this directory until one of its files changes "
+             f"(default if given without value: {DEFAULT_STATE_DIR})"
+    )
+    argumentParser.add_argument(
+        "-l", "--level", default="medium", choices=[level for level in CIPHER_LEVELS if level != "null"],
+        help="no ciphers below this level allowed (default: medium)"
     )
 
     return argumentParser.parse_args()
@@ -61,7 +72,10 @@ def main():
         print(f"CRITICAL: {args.env} does not denote a file!")
         sys.exit(CRITICAL)
 
-    config = ApacheConfig(args.config, env_var_file=args.env)
+    config = ApacheConfig(args.config, env_var_file=args.env, cache_dir=args.config_cache)
+
+    if args.all_vhosts:
+        check_all_vhosts(args, config)
 
     sslciphersuite = config.get("SSLCipherSuite", args.vhost)
 
@@ -70,18 +84,78 @@ def main():
     if args.verbose:
         print(f"server_sig = {sslciphersuite}")
 
+    returnCode, message = check_cipher_suite(sslciphersuite, args.level, args.verbose)
+
+    print(message)
+    sys.exit(returnCode)
+
+
+def check_cipher_suite(sslciphersuite, level="medium", verbose=False):
+    # returns the return code and the output line for the given value
+
     # check if config is missing
     if not sslciphersuite:
-        print("CRITICAL: Missing Configuration for SSLCipherSuite")
-        sys.exit(CRITICAL)
+        return CRITICAL, "CRITICAL: Missing Configuration for SSLCipherSuite"
 
-    if 'NULL' in sslciphersuite :
-        print("CRITICAL: Allowed NULL Ciphers in Configuration for SSLCipherSuite")
-        sys.exit(CRITICAL)
+    # expand the cipher string(s) into the suites they enable (each distinct
+    # cipher string is only expanded once per run)
+    levels = {}
+    for value in sslciphersuite if type(sslciphersuite) == list else [sslciphersuite]:
+        try:
+            for cipher_level, names in grade_cipher_suite(value).items():
+                levels.setdefault(cipher_level, []).extend(names)
+        except CipherStringException as ex:
+            return CRITICAL, f"CRITICAL: Invalid Configuration for SSLCipherSuite ({ex})"
+
+    if verbose:
+        print(f"cipher_levels={levels}")
+
+    if "null" in levels:
+        return CRITICAL, "CRITICAL: Allowed NULL Ciphers in Configuration for SSLCipherSuite"
+
+    weak = [name for cipher_level, names in levels.items()
+            if CIPHER_LEVELS[cipher_level] < CIPHER_LEVELS[level] for name in names]
+
+    if weak:
+        return CRITICAL, f"CRITICAL: Allowed ciphers below {level} in Configuration for SSLCipherSuite: {', '.join(weak)}"
+
+    return OK, f"OK: no NULL ciphers and ciphers blow {level} configured!"
+
+
+def check_all_vhosts(args, config):
+    # checks the effective config of every virtual host (only the ones with
+    # SSLEngine on if any virtual host enables it)
+    vhosts = list(config.iter_effective_vhost_configs())
+    ssl_vhosts = [(label, cfg) for label, cfg in vhosts
+                  if str(cfg.get("SSLEngine", "")).lower() == "on"]
+
+    if not vhosts:
+        print("UNKNOWN: No virtual host found")
+        sys.exit(UNKNOWN)
+
+    returnCode = OK
+    failed = []
+
+    for label, vhost_cfg in ssl_vhosts or vhosts:
+        code, message = check_cipher_suite(vhost_cfg.get("SSLCipherSuite"), args.level)
+
+        if args.verbose:
+            print(f"{label}: {message}")
+
+        if code != OK:
+            failed.append((label, message))
+            returnCode = max(returnCode, code)
+
+    if not failed:
+        print(f"OK: no NULL ciphers and ciphers blow {args.level} configured in all virtual hosts!")
+        sys.exit(OK)
+
+    print(f"CRITICAL: Insecure SSLCipherSuite in {', '.join(label for label, _ in failed)}")
 
-    print("OK: no NULL ciphers and ciphers blow medium configured!")
-    sys.exit(OK)
+    for label, message in failed:
+        print(f"{label}: {message}")
 
+    sys.exit(returnCode)
 
 if __name__ == "__main__":
     main()
@@ -5,6 +5,14 @@ import sys
 import os
 import stat
 import grp
+import time
+import json
+import hashlib
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from StateFiles import DEFAULT_STATE_DIR, load_state_file, write_state_file
 
 
 # monitoring plugin return codes
@@ -13,6 +21,10 @@ WARNING = 1
 CRITICAL = 2
 UNKNOWN = 3
 
+# stats of a path stored in the snapshot
+StatsRecord = namedtuple(
+    "StatsRecord", ["st_dev", "st_ino", "st_mode", "st_uid", "st_gid", "st_ctime_ns", "st_mtime_ns"])
+
 
 def parse_args():
     # Parses the CLI Arguments and returns a dict containing the
@@ -39,53 +51,229 @@ def parse_args():
               Ubuntu/Debian locations, which are as follows: logs=/var/log/apache2, binaries=/usr/sbin/apache2, \
               libs/modules=/usr/lib/apache2, config=/etc/apache2. (Ineffective with option '-r')"
     )
+    argumentParser.add_argument(
+        "--snapshot-dir", nargs="?", const=DEFAULT_STATE_DIR, default=None,
+        help="store the stats of the checked paths in this directory, directories whose ctime and \
+              mtime didn't change since the last run are not listed again and the stored stats of \
+              their files are checked "
+             f"(default if given without value: {DEFAULT_STATE_DIR})"
+    )
+    argumentParser.add_argument(
+        "--full-scan-interval", metavar="SECONDS", type=int, default=86400,
+        help="max age of the snapshot before all paths are scanned again, changes that don't \
+              modify the directory (e.g. chmod of a file) are only found by a full scan (default: 86400)"
+    )
+    argumentParser.add_argument(
+        "-w", "--workers", metavar="NUMBER", type=int, default=None,
+        help="number of threads scanning the top level subdirectories in parallel \
+              (default: depends on the cpu count, 1 disables the thread pool)"
+    )
 
     return argumentParser.parse_args()
 
 
-def check_stats(path, groups, verbose=False):
-    # Retrieves dir/file stats and checks against guidelines
-
-    # convert group names to group ids
-    groupids = [grp.getgrnam(g).gr_gid for g in groups]
-
-    # get file stats
-    stats = os.stat(path)
-
-    # Print path and stats if verbose output is enabled
-    if verbose:
-        print(f"Processing: {path}... ", end="")
+def check_stats(path, stats, groupids, groups, verbose=False):
+    # Checks dir/file stats against guidelines and returns the return code
+    # and the output (printed by the caller in walk order)
+    messages = []
 
     returnCode = OK
 
     # Check if owner or group differs from root (ID=0)
     if stats.st_uid != 0:
-        print(f"WARNING: {path} Owner differs from root")
+        messages.append(f"WARNING: {path} Owner differs from root")
         returnCode = WARNING
 
     # if (stats.st_gid != groupid):
     if not stats.st_gid in groupids:
-        print(f"WARNING: {path} Group differs from {groups}")
+        messages.append(f"WARNING: {path} Group differs from {groups}")
         returnCode = WARNING
 
     # Check if user differs from root and has write permissions
     if stats.st_uid != 0 and stats.st_mode & stat.S_IWUSR:
-        print(
+        messages.append(
             f"CRITICAL: {path} Owner differs from root and has write permissions")
         returnCode = CRITICAL
 
     # Check if group has write permissions
     if (stats.st_mode & stat.S_IWGRP):
-        print(f"CRITICAL: {path} Group has write permissions")
+        messages.append(f"CRITICAL: {path} Group has write permissions")
         returnCode = CRITICAL
 
     # Check if "everybody" has write permissions
     if (stats.st_mode & stat.S_IWOTH):
-        print(f"CRITICAL: {path} 'Everybody' has write permissions")
+        messages.append(f"CRITICAL: {path} 'Everybody' has write permissions")
         returnCode = CRITICAL
 
-    if verbose and returnCode == OK:
-        print("Ok.")
+    output = "".join(f"{message}\n" for message in messages)
+
+    # Print path and stats if verbose output is enabled
+    if verbose:
+        output = f"Processing: {path}... {output}" + ("Ok.\n" if returnCode == OK else "")
+
+    return returnCode, output
+
+
+class PermissionWalker:
+    # walks a directory tree like os.walk (top down) using os.scandir, the
+    # stats cached by the DirEntry objects are checked directly
+
+    def __init__(self, groups, skip=(), followlinks=False, verbose=False, workers=None, snapshot=None):
+        self.groups = groups
+        # group names are only resolved once per run
+        self.groupids = [grp.getgrnam(g).gr_gid for g in groups]
+        self.skip = skip
+        self.followlinks = followlinks
+        self.verbose = verbose
+        self.workers = workers
+        # listings of the last run: directory -> stats, files and subdirs
+        self.snapshot = snapshot if snapshot is not None else {}
+        # listings of the current run (stored as the next snapshot)
+        self.listings = {}
+
+    def check(self, path, stats):
+        return check_stats(path, stats, self.groupids, self.groups, self.verbose)
+
+    def walk(self, path):
+        # checks the directory and everything below it, returns the results
+        # in the order os.walk would have produced them
+        stats = os.stat(path)
+        ancestors = frozenset([_get_key(stats)])
+
+        if self.workers == 1:
+            return self._walk(path, stats, ancestors)
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            return self._walk(path, stats, ancestors, executor)
+
+    def _walk(self, path, stats, ancestors, executor=None):
+        # ancestors contains the (dev, inode) of the directories on the path
+        # from the walked root down to this directory
+        listing = self._list(path, stats)
+
+        # os.walk ignores directories that can't be listed
+        if listing is None:
+            return []
+
+        files, subdirs = listing
+        results = [self.check(path, stats)]
+        results += [self.check(file_path, file_stats) for file_path, file_stats in files]
+
+        # subdirectories are processed after the files of the directory
+        subtrees = []
+
+        for subdir_path, stats in subdirs:
+            key = _get_key(stats)
+
+            # only symlink loops are skipped, directories reached via several
+            # paths are checked on each of them (like os.walk)
+            if key in ancestors:
+                continue
+
+            if executor:
+                # the top level subtrees are scanned in parallel
+                subtrees.append(executor.submit(
+                    self._walk, subdir_path, stats, ancestors | {key}))
+            else:
+                subtrees.append(self._walk(subdir_path, stats, ancestors | {key}))
+
+        for subtree in subtrees:
+            results += subtree.result() if executor else subtree
+
+        return results
+
+    def _list(self, path, stats):
+        # returns the (path, stats) of the files and subdirectories, taken
+        # from the snapshot if the directory didn't change since
+        record = _to_record(stats)
+        cached = self.snapshot.get(path)
+
+        if cached and StatsRecord(*cached["stats"]) == record:
+            try:
+                files = [(os.path.join(path, name), StatsRecord(*values))
+                         for name, values in cached["files"]]
+                subdirs = [(os.path.join(path, name), os.stat(os.path.join(path, name)))
+                           for name in cached["subdirs"]]
+            except OSError:
+                # a subdirectory was replaced -> list the directory again
+                pass
+            else:
+                self.listings[path] = cached
+                return files, subdirs
+
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError:
+            return None
+
+        files = []
+        subdirs = []
+
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if not is_dir:
+                files.append((entry.path, entry.stat()))
+
+            # skip blacklisted directories
+            elif entry.name not in self.skip and (self.followlinks or not entry.is_symlink()):
+                subdirs.append((entry.path, entry.stat()))
+
+        self.listings[path] = {
+            "stats": record,
+            "files": [(os.path.basename(file_path), _to_record(file_stats))
+                      for file_path, file_stats in files],
+            "subdirs": [os.path.basename(subdir_path) for subdir_path, _ in subdirs]
+        }
+
+        return files, subdirs
+
+
+def _get_key(stats):
+    # identifies a directory independent of the path it was reached by
+    return (stats.st_dev, stats.st_ino)
+
+
+def _to_record(stats):
+    return StatsRecord(stats.st_dev, stats.st_ino, stats.st_mode, stats.st_uid,
+                       stats.st_gid, stats.st_ctime_ns, stats.st_mtime_ns)
+
+
+def load_snapshot(snapshot_file, key, full_scan_interval):
+    # returns the listings of the last run and the time of the last full
+    # scan, the listings are empty if a full scan is due (or the snapshot
+    # wasn't created by the current user)
+    snapshot = load_state_file(snapshot_file)
+
+    if not isinstance(snapshot, dict) or snapshot.get("key") != key or \
+            time.time() - snapshot.get("full_scan", 0) >= full_scan_interval:
+        return {}, time.time()
+
+    return snapshot["listings"], snapshot["full_scan"]
+
+
+def save_snapshot(snapshot_file, key, listings, full_scan):
+    snapshot = {
+        "key": key,
+        "full_scan": full_scan,
+        "listings": listings
+    }
+
+    # the next run simply scans all paths again if writing fails
+    write_state_file(snapshot_file, json.dumps(snapshot).encode())
+
+
+def print_results(results):
+    # prints the output of the checked paths and returns the worst code
+    returnCode = OK
+
+    for code, output in results:
+        print(output, end="")
+        returnCode = max(returnCode, code)
 
     return returnCode
 
@@ -103,6 +291,14 @@ def main():
     # start with returnCode OK
     returnCode = OK
 
+    # listings of unchanged directories are taken from the last run
+    snapshot = {}
+    if args.snapshot_dir:
+        key = json.dumps([args.srv_root, args.skip if args.srv_root else args.paths])
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        snapshot_file = os.path.join(args.snapshot_dir, f"srv_root_{digest}.json")
+        snapshot, full_scan = load_snapshot(snapshot_file, key, args.full_scan_interval)
+
     # check if server root is specified
     if args.srv_root:
         # Check if configured path denotes a directory
@@ -111,45 +307,32 @@ def main():
             sys.exit(CRITICAL)
 
         # Process ServerRoot and all subdirs
-        for root, dirs, files in os.walk(args.srv_root, followlinks=True):
-            # Process the current directory
-            returnCode = max(returnCode, check_stats(
-                root, args.group, args.verbose))
-
-            # skip blacklisted directories
-            for i, name in enumerate(dirs):
-                if name in args.skip:
-                    del dirs[i]
-
-            # Process all files in the current directory
-            for name in files:
-                returnCode = max(returnCode, check_stats(
-                    os.path.join(root, name), args.group, args.verbose))
+        walker = PermissionWalker(args.group, args.skip, followlinks=True, verbose=args.verbose,
+                                  workers=args.workers, snapshot=snapshot)
+        returnCode = print_results(walker.walk(args.srv_root))
 
     else:
+        walker = PermissionWalker(args.group, verbose=args.verbose, workers=args.workers,
+                                  snapshot=snapshot)
+
         # Process all configured paths
         for path in args.paths:
 
             # Check if the given path denotes a files -> directly process it
             if os.path.isfile(path):
-                returnCode = max(returnCode, check_stats(
-                    path, args.group, args.verbose))
+                returnCode = max(returnCode, print_results(
+                    [walker.check(path, os.stat(path))]))
 
             # recursively process folder
             elif os.path.isdir(path):
-                for root, _, files in os.walk(path):
-                    # Process the current folder
-                    returnCode = max(returnCode, check_stats(
-                        root, args.group, args.verbose))
-
-                    # Process each file in the current directory
-                    for name in files:
-                        returnCode = max(returnCode, check_stats(
-                            os.path.join(root, name), args.group, args.verbose))
+                returnCode = max(returnCode, print_results(walker.walk(path)))
             else:
                 print(f"CRITICAL: {path} is neither a file nor a directory!")
                 sys.exit(CRITICAL)
 
+    if args.snapshot_dir:
+        save_snapshot(snapshot_file, key, walker.listings, full_scan)
+
     if returnCode == OK:
         print("OK: ServerRoot Permission are ok.")
 
@@ -6,6 +6,7 @@ import re
 import os
 
 from ApacheConfig import ApacheConfig
+from StateFiles import DEFAULT_STATE_DIR
 
 # monitoring plugin return codes
 OK = 0
@@ -35,6 +36,15 @@ def parse_args():
         "-vh", "--vhost", default=None,
         help="virtual host whose config should be loaded (if any)"
     )
+    argumentParser.add_argument(
+        "-a", "--all-vhosts", nargs="?", const=True, default=False,
+        help="check the main config and every virtual host in one run (ignores --vhost)"
+    )
+    argumentParser.add_argument(
+        "--config-cache", nargs="?", const=DEFAULT_STATE_DIR, default=None,
+        help="cache the parsed config in this directory until one of its files changes "
+             f"(default if given without value: {DEFAULT_STATE_DIR})"
+    )
 
     return argumentParser.parse_args()
 
@@ -57,7 +67,10 @@ def main():
         print(f"CRITICAL: {args.env} does not denote a file!")
         sys.exit(CRITICAL)
 
-    config = ApacheConfig(args.path, env_var_file=args.env)
+    config = ApacheConfig(args.path, env_var_file=args.env, cache_dir=args.config_cache)
+
+    if args.all_vhosts:
+        check_all_vhosts(args, config)
 
     server_sig = config.get("ServerSignature", args.vhost)
     server_tokens = config.get("ServerTokens", args.vhost)
@@ -67,22 +80,60 @@ def main():
         print(f"server_sig = {server_sig}")
         print(f"server_tokens = {server_tokens}")
 
+    returnCode, messages = check_server_tokens(server_sig, server_tokens)
+
+    for message in messages:
+        print(message)
+
+    sys.exit(returnCode)
+
+
+def check_server_tokens(server_sig, server_tokens):
+    # returns the return code and the output lines for the given values
+
     # check if either ServerSignature or ServerTokens config is missing
     if not server_sig or not server_tokens:
-        print("CRITICAL: Missing Configuration for ServerSignature and/or ServerTokens")
-        sys.exit(CRITICAL)
+        return CRITICAL, ["CRITICAL: Missing Configuration for ServerSignature and/or ServerTokens"]
 
     if server_sig != "Off" or server_tokens != "Prod":
-        print("WARNING: Potentially insecure configuration for ServerSignature and/or ServerTokens")
-        print(
-            f"Configured Value: 'ServerSignature {server_sig}', should be 'ServerSignature Off'")
-        print(
-            f"Configured Value: 'ServerTokens {server_tokens}', should be 'ServerTokens Prod'")
-        sys.exit(WARNING)
+        return WARNING, [
+            "WARNING: Potentially insecure configuration for ServerSignature and/or ServerTokens",
+            f"Configured Value: 'ServerSignature {server_sig}', should be 'ServerSignature Off'",
+            f"Configured Value: 'ServerTokens {server_tokens}', should be 'ServerTokens Prod'"
+        ]
+
+    return OK, ["OK: Server Information hidden"]
+
+
+def check_all_vhosts(args, config):
+    # checks the main config and the effective config of every virtual host
+    returnCode, messages = check_server_tokens(
+        config.get("ServerSignature"), config.get("ServerTokens"))
+    failed = [("main config", messages)] if returnCode != OK else []
+
+    for label, vhost_cfg in config.iter_effective_vhost_configs():
+        code, messages = check_server_tokens(
+            vhost_cfg.get("ServerSignature"), vhost_cfg.get("ServerTokens"))
+
+        if args.verbose:
+            print(f"{label}: {messages[0]}")
+
+        if code != OK:
+            failed.append((label, messages))
+            returnCode = max(returnCode, code)
+
+    if not failed:
+        print("OK: Server Information hidden in all virtual hosts")
+        sys.exit(OK)
+
+    print(f"{'CRITICAL' if returnCode == CRITICAL else 'WARNING'}: "
+          f"Insecure ServerSignature and/or ServerTokens in {', '.join(label for label, _ in failed)}")
 
-    print("OK: Server Information hidden")
-    sys.exit(OK)
+    for label, messages in failed:
+        for message in messages[1:] or messages:
+            print(f"{label}: {message}")
 
+    sys.exit(returnCode)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,58 @@
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from AccessRules import AccessRules, DENIED, GRANTED, RESTRICTED
+
+
+# sections as returned by ApacheConfig (argument -> directives)
+MAIN_CONFIG = {
+    "Directory": [
+        {"/": {"Require": "all denied"}},
+        {"/var/www/*": {"Require": "all granted"}},
+        {"/srv/private": {"Require": "ip 10.0.0.0/8"}}
+    ],
+    "FilesMatch": {"\"^\\.ht\"": {"Require": "all denied"}}
+}
+
+
+class AccessRulesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = AccessRules(MAIN_CONFIG)
+
+    def test_wildcard_section_applies_to_subdirectories(self):
+        self.assertEqual(self.rules.get_access("/var/www/site", is_dir=True), GRANTED)
+        self.assertEqual(self.rules.get_access("/var/www/site/public", is_dir=True), GRANTED)
+        self.assertEqual(self.rules.get_access("/var/www/site/public/index.html"), GRANTED)
+
+    def test_wildcard_matches_whole_path_components(self):
+        self.assertEqual(self.rules.get_access("/var/wwwdata/site", is_dir=True), DENIED)
+        self.assertEqual(self.rules.get_access("/var/www", is_dir=True), DENIED)
+
+    def test_files_section_protects_ht_files_below_wildcard(self):
+        self.assertEqual(self.rules.get_access("/var/www/site/public/.htaccess"), DENIED)
+
+    def test_ht_files_granted_without_files_section(self):
+        rules = AccessRules({"Directory": MAIN_CONFIG["Directory"]})
+
+        # e.g. DocumentRoot /var/www/site/public
+        self.assertEqual(rules.get_access("/var/www/site/public/.htaccess"), GRANTED)
+
+    def test_longer_directory_overrides_parent(self):
+        self.assertEqual(self.rules.get_access("/srv/private/data", is_dir=True), RESTRICTED)
+        self.assertEqual(self.rules.get_access("/srv", is_dir=True), DENIED)
+
+    def test_vhost_sections_are_merged_after_main_config(self):
+        vhost = AccessRules({"Directory": {"/srv": {"Require": "all granted"}}}, parent=self.rules)
+
+        self.assertEqual(vhost.get_access("/srv/site", is_dir=True), GRANTED)
+        self.assertEqual(vhost.get_access("/srv/private/data", is_dir=True), RESTRICTED)
+        self.assertEqual(vhost.get_access("/srv/site/.htpasswd"), DENIED)
+
+
+if __name__ == "__main__":
+    unittest.main()
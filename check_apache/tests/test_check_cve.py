@@ -0,0 +1,195 @@
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from check_cve import FeedException, get_cached_index
+
+
+FEED = b"""<?xml version="1.0" encoding="UTF-8"?>
+<security updated="20240101">
+  <issue fixed="2.4.58">
+    <cve name="CVE-2023-45802"/>
+    <severity level="3">moderate</severity>
+    <affects prod="httpd" version="2.4.57"/>
+  </issue>
+  <issue fixed="2.4.56">
+    <cve name="CVE-2023-25690"/>
+    <severity level="1">critical</severity>
+    <affects prod="httpd" version="2.4.55"/>
+    <affects prod="httpd" version="2.4.57"/>
+  </issue>
+</security>
+"""
+
+ETAG = '"feed-1"'
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    # serves the feed of the server with an ETag and answers revalidations
+    # (or every request if not_modified is set) with 304
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+
+        if self.server.not_modified or self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(self.server.feed)))
+        self.end_headers()
+        self.wfile.write(self.server.feed)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CachedFeedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+        self.server.requests = []
+        self.server.feed = FEED
+        self.server.not_modified = False
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+        self.cache_dir = tempfile.mkdtemp()
+        self.meta_file = os.path.join(self.cache_dir, "vulnerabilities-httpd.json")
+        self.args = SimpleNamespace(
+            url=f"http://127.0.0.1:{self.server.server_address[1]}/vulnerabilities-httpd.xml",
+            timeout=5, cache_dir=self.cache_dir, max_age=3600, verbose=False)
+
+    def tearDown(self):
+        self.stop_server()
+        shutil.rmtree(self.cache_dir)
+
+    def stop_server(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def set_validated(self, validated):
+        with open(self.meta_file, "r") as file:
+            meta = json.load(file)
+
+        meta["validated"] = validated
+
+        with open(self.meta_file, "w") as file:
+            json.dump(meta, file)
+
+    def test_download_stores_etag_and_index(self):
+        index, age = get_cached_index(self.args)
+
+        self.assertEqual(age, 0)
+        self.assertEqual(index["2.4.57"], [4, ["CVE-2023-45802", "CVE-2023-25690"]])
+        self.assertEqual(index["2.4.55"], [4, ["CVE-2023-25690"]])
+
+        with open(self.meta_file, "r") as file:
+            self.assertEqual(json.load(file)["etag"], ETAG)
+
+    def test_fresh_cache_makes_no_request(self):
+        get_cached_index(self.args)
+        index, age = get_cached_index(self.args)
+
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertIn("2.4.57", index)
+        self.assertLess(age, self.args.max_age)
+
+    def test_expired_cache_is_revalidated(self):
+        get_cached_index(self.args)
+        self.set_validated(time.time() - 2 * self.args.max_age)
+
+        index, age = get_cached_index(self.args)
+
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[1].get("If-None-Match"), ETAG)
+        self.assertEqual(age, 0)
+        self.assertIn("2.4.57", index)
+
+    def test_stale_cache_is_served_if_server_is_down(self):
+        get_cached_index(self.args)
+        self.set_validated(time.time() - 2 * self.args.max_age)
+        self.stop_server()
+
+        index, age = get_cached_index(self.args)
+
+        self.assertIn("2.4.57", index)
+        self.assertGreaterEqual(age, 2 * self.args.max_age)
+
+    def test_validated_in_the_future_is_stale(self):
+        get_cached_index(self.args)
+        self.set_validated(time.time() + 1e9)
+
+        index, age = get_cached_index(self.args)
+
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(age, 0)
+
+        # without server the age of such a cache is unknown -> not served
+        self.set_validated(time.time() + 1e9)
+        self.stop_server()
+
+        with self.assertRaises(FeedException):
+            get_cached_index(self.args)
+
+    def test_stale_cache_is_served_if_feed_is_broken(self):
+        get_cached_index(self.args)
+        self.set_validated(time.time() - 2 * self.args.max_age)
+
+        # changed feed (new ETag -> no 304) that can't be parsed
+        self.server.feed = FEED[:100]
+        with open(self.meta_file, "r") as file:
+            meta = json.load(file)
+        meta["etag"] = '"feed-0"'
+        with open(self.meta_file, "w") as file:
+            json.dump(meta, file)
+
+        index, age = get_cached_index(self.args)
+
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIn("2.4.57", index)
+        self.assertGreaterEqual(age, 2 * self.args.max_age)
+
+    def test_broken_feed_without_cache_fails(self):
+        self.server.feed = FEED[:100]
+
+        with self.assertRaises(FeedException):
+            get_cached_index(self.args)
+
+    def test_not_modified_without_cache_fails(self):
+        self.server.not_modified = True
+
+        with self.assertRaises(FeedException):
+            get_cached_index(self.args)
+
+    def test_cache_writable_by_others_is_ignored(self):
+        get_cached_index(self.args)
+
+        # e.g. planted with an empty index
+        with open(self.meta_file, "w") as file:
+            json.dump({"url": self.args.url, "validated": time.time(), "index": {}}, file)
+        os.chmod(self.meta_file, 0o666)
+
+        index, _ = get_cached_index(self.args)
+
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertIn("2.4.57", index)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,14 +1,14 @@
 #!/bin/python
 
 """
-	The following Class is a modified version of the Cookie Class found in the python nagiosplugin module.
-	Download: https://pypi.org/project/nagiosplugin/#files
+    The following Class is a modified version of the Cookie Class found in the python nagiosplugin module.
+    Download: https://pypi.org/project/nagiosplugin/#files
 """
 
 import os
+import stat
 import fcntl
 import tempfile
-import codecs
 import json
 
 try:
@@ -18,18 +18,18 @@ except ImportError:
 
 class Cookie(UserDict, object):
 
-	def __init__(self, statefile=None):
-		super(self)
-		self.path = statefile
-		self.file_obj = None
-		
-	def __enter__(self):
+    def __init__(self, statefile=None):
+        super(Cookie, self).__init__()
+        self.path = statefile
+        self.file_obj = None
+
+    def __enter__(self):
         """Allows Cookie to be used as context manager.
 
         Opens the file and passes a dict-like object into the
         subordinate context. See :meth:`open` for details about opening
         semantics. When the context is left in the regular way (no
-        exception raised), the cookie is :meth:`commit`\ ted to disk.
+        exception raised), the cookie is :meth:`commit`\\ ted to disk.
 
         :yields: open cookie
         """
@@ -41,19 +41,16 @@ class Cookie(UserDict, object):
             self.commit()
         self.close()
 
-	def open(self):
+    def open(self):
         """Reads/creates the state file and initializes the dict.
 
         If the state file does not exist, it is touched into existence.
         An exclusive lock is acquired to ensure serialized access. If
         :meth:`open` fails to parse file contents, it truncates
-        the file before raising an exception. This guarantees that
-        plugins will not fail repeatedly when their state files get
-        damaged.
+        the file and starts with an empty dict. This guarantees that
+        plugins will not fail when their state files get damaged.
 
         :returns: Cookie object (self)
-        :raises ValueError: if the state file is corrupted or does not
-            deserialize into a dict
         """
         self.file_obj = self._create_file_object()
         self._file_lock_exclusive(self.file_obj)
@@ -62,18 +59,33 @@ class Cookie(UserDict, object):
                 self.data = self._load()
             except ValueError:
                 self.file_obj.truncate(0)
-                raise
+                self.data = {}
         return self
-		
-	def _create_file_object(self):
-        if not self.path:
-			return tempfile.TemporaryFile(mode='w+', encoding='acsii', 
-								suffix='', prefix='plugin_cookie_', dir=None)
-        # mode='a+' has problems with mixed R/W operation on Mac OS X
-        try:
-            return codecs.open(self.path, 'r+', encoding='ascii')
-        except IOError:
-            return codecs.open(self.path, 'w+', encoding='ascii')
+
+    def _create_file_object(self):
+        if self.path:
+            try:
+                return os.fdopen(self._open_private(self.path), 'r+', encoding='ascii')
+            except (OSError, ValueError):
+                # a state file planted by another user must not be used,
+                # start with an empty state that is not kept
+                pass
+        return tempfile.TemporaryFile(mode='w+', encoding='ascii',
+                                      suffix='', prefix='plugin_cookie_', dir=None)
+
+    def _open_private(self, path):
+        """Opens (or creates) the state file without following symlinks.
+
+        :raises ValueError: if the file is not a regular file of the
+            current user or can be modified by other users
+        """
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        stats = os.fstat(fd)
+        if not stat.S_ISREG(stats.st_mode) or stats.st_uid != os.geteuid() or \
+                stats.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            os.close(fd)
+            raise ValueError('state file is not private', path)
+        return fd
 
     def _load(self):
         self.file_obj.seek(0)
@@ -110,7 +122,7 @@ class Cookie(UserDict, object):
         self.file_obj.write('\n')
         self.file_obj.flush()
         os.fsync(self.file_obj)
-	
-	def _file_lock_exclusive(self, file):
-		"""Acquire Exclusive File Lock (POSIX Only)"""
-		fcntl.flock(file, fcntl.LOCK_EX)
\ No newline at end of file
+
+    def _file_lock_exclusive(self, file):
+        """Acquire Exclusive File Lock (POSIX Only)"""
+        fcntl.flock(file, fcntl.LOCK_EX)
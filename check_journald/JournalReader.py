@@ -14,22 +14,32 @@ class JournalReader(journal.Reader):
 			self.add_match(match)
 		
 	def set_timeframe(self, timeframe):
-		start_time = datetime.now()
+		start_time = self.get_start_time(timeframe)
+
+		print("Accessing log entries after: %s" % (start_time), end="\n")
+		self.seek_realtime(start_time)
+
+	def get_start_time(self, timeframe):
+		# returns the beginning of the timeframe (e.g. 1h) ending now
 		match = re.match('(\d{1,2})([dhm])', timeframe)
-		
+
 		if not match:
 			raise InvalidTimeframeException()
-		else:
-			quantity = max(int(match.group(1)), 1)
-			identifier = match.group(2)
-			
-			start_time -= self._timeDelta(quantity, identifier)
-			
-			
-			print("Accessing log entries after: %s" % (start_time), end="\n")
-			self.seek_realtime(start_time)
-			
-			
+
+		quantity = max(int(match.group(1)), 1)
+		return datetime.now() - self._timeDelta(quantity, match.group(2))
+
+	def seek_after_cursor(self, cursor):
+		# positions the reader after the entry of the cursor (e.g. the last
+		# entry of the previous run), so only newer entries are returned
+		print("Accessing log entries after cursor: %s" % (cursor), end="\n")
+		self.seek_cursor(cursor)
+
+		# the entry of the cursor may be gone (journal rotated) -> the reader
+		# is at the next entry, which must not be skipped
+		if self.get_next() and not self.test_cursor(cursor):
+			self.get_previous()
+
 	def _timeDelta(self, quantity, identifier):
 		if identifier == "d":
 			return timedelta(days=quantity);
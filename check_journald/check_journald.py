@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 
-import re, sys, argparse, os
+import re, sys, argparse, os, json, hashlib, stat, tempfile, time
 from JournalReader import JournalReader
+from Cookie import Cookie
 
 # define period
 def period(string):
@@ -14,6 +15,32 @@ def printPerformanceData(label, ctr, warn, crit):
 	data = ["%s=%s" % (label, str(ctr)), str(warn), str(crit)]
 	print("|" + ";".join(data))
 
+# per user directory for the state files, other users can't plant files with
+# the predictable names there (unlike /tmp itself)
+DEFAULT_STATE_DIR = os.path.join(tempfile.gettempdir(), "check_journald-%d" % os.geteuid())
+
+def getStateFile(arguments):
+	# the state only applies to the same journal, matches, regex and period
+	if not arguments.state_dir:
+		return None
+
+	if arguments.state_dir == DEFAULT_STATE_DIR:
+		try:
+			os.makedirs(DEFAULT_STATE_DIR, 0o700, exist_ok=True)
+			stats = os.lstat(DEFAULT_STATE_DIR)
+		except OSError:
+			stats = None
+
+		# the name is predictable -> another user may have created it first
+		if not stats or not stat.S_ISDIR(stats.st_mode) or stats.st_uid != os.geteuid() or \
+				stats.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+			print("%s is not a private directory, the state is not kept" % DEFAULT_STATE_DIR)
+			return None
+
+	key = json.dumps([arguments.path, arguments.matches, arguments.regex, arguments.period])
+	digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+	return os.path.join(arguments.state_dir, "check_journald_%s.json" % digest)
+
 def main():
 	# monitoring plugin return codes
 	OK = 0
@@ -53,6 +80,10 @@ def main():
 	argumentParser.add_argument(
 		'-r', '--regex', help='Regular expression to match message content'
 	)
+	argumentParser.add_argument(
+		'--state-dir', nargs="?", const=DEFAULT_STATE_DIR, default=None,
+		help='keep the last journal cursor and per minute counts in this directory, \
+		      each run only reads the new entries (default if given without value: %s)' % DEFAULT_STATE_DIR)
 
 	arguments = argumentParser.parse_args()
 
@@ -66,38 +97,66 @@ def main():
 		journal.add_matches(arguments.matches)
 	
 	
-	journal.set_timeframe(arguments.period)
-	
-	if arguments.regex:
-		regex = re.compile(arguments.regex)
-		#print(regex)
-		# filter journal by regex
-		entries = [entry for entry in journal if regex.search(entry["MESSAGE"])]
-		journal.close()
-		
-		if regex.groups == 1:
-			ctr = {}
+	regex = re.compile(arguments.regex) if arguments.regex else None
+	start_time = journal.get_start_time(arguments.period)
+	# first minute of the period (the counts of the whole minute are used)
+	first_minute = int(start_time.timestamp()) // 60 * 60
+
+	# without state dir the cookie is a temporary file -> all entries of the
+	# period are read
+	with Cookie(getStateFile(arguments)) as state:
+		# continue after the last entry of the previous run unless it is
+		# older than the period (or in the future, e.g. clock stepped back)
+		timestamp = state.get("timestamp")
+		if state.get("cursor") and isinstance(timestamp, (int, float)) and \
+				first_minute <= timestamp <= time.time():
+			journal.seek_after_cursor(state["cursor"])
 		else:
-			ctr = 0
-	else:
-		entries = [entry for entry in journal]
+			journal.set_timeframe(arguments.period)
+			state["buckets"] = {}
+
+		# entry counts per minute (per matched group if the regex has one)
+		buckets = state.setdefault("buckets", {})
+
+		for entry in journal:
+			state["cursor"] = entry["__CURSOR"]
+			state["timestamp"] = entry["__REALTIME_TIMESTAMP"].timestamp()
+
+			# filter journal by regex
+			if regex:
+				match = regex.search(entry["MESSAGE"])
+				if not match:
+					continue
+
+			if arguments.verbose:
+				print(str(entry["__REALTIME_TIMESTAMP"]) + ": " + entry["MESSAGE"], end="\n")
+
+			minute = str(int(state["timestamp"]) // 60 * 60)
+
+			if regex and regex.groups == 1:
+				counts = buckets.setdefault(minute, {})
+				counts.setdefault(match.group(1), 0)
+				counts[match.group(1)] += 1
+			else:
+				buckets[minute] = buckets.get(minute, 0) + 1
+
 		journal.close()
-		ctr = 0
-	
-	
-	#count journal entries
-	for entry in entries:
-		if arguments.verbose:
-			print(str(entry["__REALTIME_TIMESTAMP"]) + ": " + entry["MESSAGE"], end="\n")
-		
-		if type(ctr) is dict:
-			match = regex.search(entry["MESSAGE"])
-			ctr.setdefault(match.group(1), 0)
-			ctr[match.group(1)] += 1
-		else:
-			ctr += 1
-	
-	
+
+		# drop the minutes that left the period
+		buckets = {minute: counts for minute, counts in buckets.items() if int(minute) >= first_minute}
+		state["buckets"] = buckets
+
+	#count journal entries of the period
+	if regex and regex.groups == 1:
+		ctr = {}
+		for counts in buckets.values():
+			for key, val in counts.items():
+				ctr.setdefault(key, 0)
+				ctr[key] += val
+	else:
+		ctr = sum(buckets.values())
+
+
 	returnCode = OK
 	
 	if type(ctr) is dict: